@@ -0,0 +1,137 @@
+"""Memory of the monitor: bytes per tracked position and peak RSS of a borrow-rate refresh.
+
+The fake Curve API runs in a child process so its own payloads do not count.
+
+Refresh: the bot downloads the market list of every chain (--markets per
+chain, each market in the full shape of the real API) and rebuilds its
+borrow-rate index. Reports how much the peak RSS grew and the peak of
+Python allocations during the refresh.
+
+Positions: the monitor discovers the positions of --users users and checks
+each once. Reports the Python memory held afterwards per tracked position,
+measured with tracemalloc (cached stats, keys, index and monitor state).
+
+Usage: python bench/bench_memory.py [--users 1000] [--markets 5000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from harness import free_port, load_bot, make_users, report, wait_for_api  # noqa: E402
+from scheduler import RequestBudget  # noqa: E402
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def start_api(args):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_curve_api.py'), '--port', str(port),
+                                '--markets', str(args.markets), '--latency', '0.01'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    if await wait_for_api(url):
+        return process, url
+    process.kill()
+    raise RuntimeError('fake API did not start')
+
+
+async def check_all(bot, workers=100):
+    """Check every monitored position once, from a few worker tasks rather than one task per position."""
+    keys = list(bot.monitored_positions)
+
+    async def worker():
+        while keys:
+            await bot.poll_position(keys.pop())
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+async def run(args):
+    process, url = await start_api(args)
+    bot = load_bot(tempfile.mkdtemp(prefix='bench-memory-'), url)
+    try:
+        await bot.health_store.open()
+        await bot.monitor_state_store.open()
+        await bot.market_index_store.open()
+        await bot.curve_client.start()
+
+        # Warm up imports and the connection pool so the refresh measures the refresh
+        await bot.curve_client.get_json('/v1/lending/users/ethereum/0x0')
+        gc.collect()
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        await bot.update_borrow_rates()
+        refresh_time = time.perf_counter() - start
+        rss_after = rss_mb()
+        async with bot.curve_client.session.get(f"{url}/v1/lending/markets/ethereum?fetch_on_chain=false") as response:
+            body_size = len(await response.read())
+
+        tracemalloc.start()
+        bot.borrow_rates_index = {}
+        bot.curve_client.cache.entries.clear()
+        gc.collect()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await bot.update_borrow_rates()
+        refresh_peak = tracemalloc.get_traced_memory()[1] - base
+
+        report('Borrow-rate refresh', [
+            ('markets', f"{args.markets} per chain, {len(bot.SUPPORTED_CHAINS)} chains, "
+                        f"{body_size / 1e6:.1f} MB of JSON per chain"),
+            ('time', f"{refresh_time:.2f}s"),
+            ('peak RSS', f"{rss_before:.0f} -> {rss_after:.0f} MB (+{rss_after - rss_before:.0f} MB)"),
+            ('peak Python allocations', f"{refresh_peak / 1e6:.1f} MB"),
+        ])
+
+        bot.request_budget = RequestBudget(10000)  # Discovery as fast as the fake API answers
+        users = make_users(args.users)
+        for user_id, data in users.items():
+            dict.__setitem__(bot.user_data, user_id, data)
+        bot.curve_client.cache.entries.clear()  # The market lists would be evicted while positions are measured
+        gc.collect()
+        base = tracemalloc.get_traced_memory()[0]
+        await bot.discover_positions()
+        await check_all(bot)
+        bot.snapshot_synced_at.clear()
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - base
+        positions = len(bot.monitored_positions)
+        tracemalloc.stop()
+
+        report('Tracked positions', [
+            ('users', f"{args.users} ({len(bot.monitor_subscriptions)} wallet subscriptions)"),
+            ('positions', positions),
+            ('memory held', f"{held / 1e6:.1f} MB"),
+            ('per position', f"{held / max(positions, 1):.0f} bytes"),
+            ('peak RSS', f"{rss_mb():.0f} MB"),
+        ])
+    finally:
+        await bot.curve_client.close()
+        bot.health_store.close()
+        bot.monitor_state_store.close()
+        bot.market_index_store.close()
+        process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--markets', type=int, default=5000, help='markets per chain in the market list')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
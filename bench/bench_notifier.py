@@ -0,0 +1,70 @@
+"""Drive the Notifier with a burst of alerts against a fake Bot.
+
+Simulates a market-wide crash: every user gets several position alerts at the
+same moment. Reports delivered messages per second, alert latency and how many
+alerts were merged, and checks that the global and per-chat rates are held.
+
+Usage: python bench/bench_notifier.py [--users 2000] [--alerts 3] [--flood-rate 0.001]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import FakeBot, format_percentile  # noqa: E402
+from notifier import Notifier  # noqa: E402
+
+
+async def run(users, alerts, flood_rate, rate, window):
+    fake_bot = FakeBot(flood_rate=flood_rate)
+    notifier = Notifier(fake_bot, global_rate=rate, coalesce_window=window)
+    notifier.start()
+
+    start = time.monotonic()
+    queued_at = {}
+    for user in range(users):
+        chat_id = 100000 + user
+        queued_at[chat_id] = time.monotonic()
+        for alert in range(alerts):
+            notifier.enqueue(chat_id, f"position-{alert}", f"Health of the position {alert} has fallen below 5.0.")
+
+    while len({chat_id for _, chat_id, _ in fake_bot.sent}) < users:
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - start
+    await notifier.stop()
+
+    latencies = [sent_at - queued_at[chat_id] for sent_at, chat_id, _ in fake_bot.sent]
+    send_times = sorted(sent_at for sent_at, _, _ in fake_bot.sent)
+    # Highest number of sends in any one-second window
+    peak = max(sum(1 for t in send_times[i:] if t - send_times[i] < 1.0) for i in range(0, len(send_times), 10))
+    per_chat = {}
+    for sent_at, chat_id, _ in fake_bot.sent:
+        per_chat.setdefault(chat_id, []).append(sent_at)
+    min_gap = min((b - a for times in per_chat.values() for a, b in zip(times, times[1:])), default=None)
+
+    print(f"alerts queued:        {users * alerts}")
+    print(f"messages sent:        {len(fake_bot.sent)} ({notifier.stats['merged']} alerts merged)")
+    print(f"flood control hits:   {fake_bot.floods}")
+    print(f"total time:           {elapsed:.2f}s")
+    print(f"throughput:           {len(fake_bot.sent) / elapsed:.1f} msg/s (limit {rate}/s, peak {peak} in 1s)")
+    print(f"alert latency:        p50 {statistics.median(latencies):.2f}s, p99 {format_percentile(latencies, 0.99)}")
+    print(f"min per-chat gap:     {'-' if min_gap is None else f'{min_gap:.2f}s'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--alerts', type=int, default=3, help='alerts per user in the burst')
+    parser.add_argument('--flood-rate', type=float, default=0.001, help='fraction of sends answered with RetryAfter')
+    parser.add_argument('--rate', type=float, default=25, help='global messages per second')
+    parser.add_argument('--window', type=float, default=0.5, help='coalesce window in seconds')
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.alerts, args.flood_rate, args.rate, args.window))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Exercise the Curve API guards against a slow tail and an outage of the fake API.
+
+Tail: a share of /stats requests takes --slow-latency seconds. Compares call
+latency without hedging and with the hedge delay of REQUEST_POLICIES, and the
+extra requests hedging costs.
+
+Outage: the API fails every request for --outage seconds, then recovers.
+Compares upstream requests and time to the first success after recovery with
+plain retries (3 per call, no budget or breaker) and with the retry budget
+and circuit breaker.
+
+Usage: python bench/bench_resilience.py [--calls 2000] [--concurrency 50] [--slow-fraction 0.02]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_curve_api import FakeCurveAPI  # noqa: E402
+from harness import format_percentile, report  # noqa: E402
+
+import curve_client  # noqa: E402
+import resilience  # noqa: E402
+
+
+def stats_paths(api, count):
+    controllers = api.controllers('ethereum')
+    return [f"/v1/lending/users/ethereum/0x{i:040x}/{controllers[i % len(controllers)]}/stats" for i in range(count)]
+
+
+def unguarded(client):
+    """Turn off the retry budget and circuit breaker, leaving plain retries to the caller."""
+    client.retry_budget = resilience.RetryBudget(ratio=0, min_per_second=0, max_tokens=0)
+    client.breakers['stats'] = resilience.CircuitBreaker(failure_threshold=float('inf'))
+
+
+async def timed_calls(call, paths, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    results = []
+
+    async def one(path):
+        async with semaphore:
+            start = time.monotonic()
+            results.append(await call(path))
+            latencies.append(time.monotonic() - start)
+
+    await asyncio.gather(*(one(path) for path in paths))
+    return latencies, sum(result is not None for result in results)
+
+
+async def tail(args, api):
+    rows = []
+    for name, policies in (('no hedging', {'stats': (10, None)}), ('hedged', curve_client.REQUEST_POLICIES)):
+        client = curve_client.CurveClient(base_url=api.url, policies=policies)
+        api.requests.clear()
+        latencies, _ = await timed_calls(lambda path: client.fetch_json(path, 'stats'), stats_paths(api, args.calls),
+                                         args.concurrency)
+        await client.close()
+        rows.append((name, f"p50 {format_percentile(latencies, 0.5)}  p99 {format_percentile(latencies, 0.99)}  "
+                           f"max {max(latencies):.2f}s  requests {sum(api.requests.values())} "
+                           f"(hedges {client.stats['hedges']})"))
+    return rows
+
+
+async def outage(args, api):
+    rows = []
+    for name in ('plain retries', 'budget + breaker'):
+        client = curve_client.CurveClient(base_url=api.url)
+        if name == 'plain retries':
+            unguarded(client)
+
+            async def call(path):
+                for _ in range(4):
+                    data = await client.fetch_json(path, 'stats')
+                    if data is not None:
+                        return data
+                    await asyncio.sleep(resilience.backoff_delay(1))
+                return None
+        else:
+            # Cool down within the benchmark instead of after BREAKER_COOLDOWN
+            client.breakers['stats'] = resilience.CircuitBreaker(cooldown=args.outage / 4)
+
+            async def call(path):
+                return await client.fetch_json(path, 'stats')
+
+        api.requests.clear()
+        api.error_rate = 1.0
+        recovered_at = None
+        first_success = None
+
+        async def recover():
+            nonlocal recovered_at
+            await asyncio.sleep(args.outage)
+            api.error_rate = 0.0
+            recovered_at = time.monotonic()
+
+        async def traced(path):
+            nonlocal first_success
+            data = await call(path)
+            if data is not None and first_success is None:
+                first_success = time.monotonic()
+            return data
+
+        # Calls keep arriving through the outage like monitor polls do
+        paths = stats_paths(api, args.calls)
+        interval = (args.outage * 2) / len(paths)
+
+        async def arrivals():
+            tasks = []
+            for path in paths:
+                tasks.append(asyncio.create_task(traced(path)))
+                await asyncio.sleep(interval)
+            return await asyncio.gather(*tasks)
+
+        recovery = asyncio.create_task(recover())
+        results = await arrivals()
+        await recovery
+        await client.close()
+        ok = sum(result is not None for result in results)
+        during = f"{first_success - recovered_at:.2f}s" if first_success else '-'
+        rows.append((name, f"upstream requests {sum(api.requests.values())} for {len(paths)} calls, "
+                           f"{ok} succeeded, first success {during} after recovery, "
+                           f"retries {client.stats['retries']}, shed {client.stats['shed']}"))
+    api.error_rate = 0.0
+    return rows
+
+
+async def run(args):
+    logging_level = curve_client.logger.level
+    curve_client.logger.setLevel('CRITICAL')  # Every failed attempt is logged as an error
+    api = FakeCurveAPI(latency=args.latency, slow_fraction=args.slow_fraction, slow_latency=args.slow_latency)
+    await api.start()
+    try:
+        report('Slow tail', [('setup', f"{args.calls} calls, {args.slow_fraction:.0%} take {args.slow_latency}s")]
+               + await tail(args, api))
+        api.slow_fraction = 0.0
+        report('Outage', [('setup', f"{args.calls} calls over {args.outage * 2:.0f}s, "
+                                    f"API down for the first {args.outage:.0f}s")]
+               + await outage(args, api))
+    finally:
+        await api.stop()
+        curve_client.logger.setLevel(logging_level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake API latency in seconds')
+    parser.add_argument('--slow-fraction', type=float, default=0.02)
+    parser.add_argument('--slow-latency', type=float, default=3.0)
+    parser.add_argument('--outage', type=float, default=10.0, help='seconds the API fails every request')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
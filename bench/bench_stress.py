@@ -0,0 +1,90 @@
+"""Time the /stress engine over many positions and price shocks.
+
+Loop: the same formulas evaluated in Python, one position and shock at a time.
+Vectorized: stress.load_positions + stress.stress_test over all of them at once.
+
+Usage: python bench/bench_stress.py [--positions 1000 5000 20000] [--shocks 50] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stress  # noqa: E402
+
+
+def make_stats(count, seed=1):
+    rng = random.Random(seed)
+    stats_list = []
+    for _ in range(count):
+        health = rng.uniform(1, 90)
+        debt = rng.uniform(100, 1e6)
+        price = rng.uniform(1000, 4000)
+        n1 = rng.randint(-50, 50)
+        stats_list.append({'health_full': health, 'debt': debt, 'oracle_price': price,
+                           'collateral': debt * (1 + health / 100) / (price * (1 - stress.LIQUIDATION_DISCOUNT)),
+                           'n1': n1, 'n2': n1 + rng.randint(3, 50), 'soft_liquidation': health < 3})
+    return stats_list
+
+
+def stress_loop(stats_list, shocks):
+    """Reference implementation with a Python loop per position."""
+    band_width = stress.AMPLIFICATION / (stress.AMPLIFICATION - 1)
+    results = []
+    for stats in stats_list:
+        price = stats['oracle_price']
+        health = stats['health_full'] / 100
+        slope = stats['collateral'] * (1 - stress.LIQUIDATION_DISCOUNT) / stats['debt']
+        liquidation_price = max(price - health / slope, 0.0)
+        soft_liquidation_price = liquidation_price * band_width ** max(stats['n2'] - stats['n1'] + 1, 1)
+        if stats['soft_liquidation']:
+            soft_liquidation_price = max(soft_liquidation_price, price)
+        row = []
+        for shock in shocks:
+            projected = health + slope * price * shock
+            row.append((projected * 100, price * (1 + shock) <= soft_liquidation_price and projected > 0,
+                        projected <= 0))
+        results.append((row, soft_liquidation_price, liquidation_price))
+    return results
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--positions', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--shocks', type=int, default=50, help='price shocks between -50%% and +10%%')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    shocks = [-0.5 + 0.6 * i / (args.shocks - 1) for i in range(args.shocks)]
+    print(f"{'positions':>10} {'scenarios':>10} {'loop (ms)':>10} {'load (ms)':>10} {'stress (ms)':>12} {'speed-up':>9}")
+    for count in args.positions:
+        stats_list = make_stats(count)
+        positions = stress.load_positions(stats_list)
+
+        # Both implementations must agree before their times mean anything
+        result = stress.stress_test(positions, shocks)
+        reference = stress_loop(stats_list, shocks)
+        assert abs(result.health[-1, 0] - reference[-1][0][0][0]) < 1e-6
+        assert result.liquidated.sum() == sum(cell[2] for row, _, _ in reference for cell in row)
+
+        loop = best_of(args.repeat, stress_loop, stats_list, shocks)
+        load = best_of(args.repeat, stress.load_positions, stats_list)
+        vectorized = best_of(args.repeat, stress.stress_test, positions, shocks)
+        print(f"{count:>10} {len(shocks):>10} {loop * 1000:>10.1f} {load * 1000:>10.2f} {vectorized * 1000:>12.2f} "
+              f"{loop / (load + vectorized):>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
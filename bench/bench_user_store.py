@@ -0,0 +1,77 @@
+"""Compare the cost of saving one user's settings as the number of users grows.
+
+Old: rewrite the whole user_data.json on every change.
+New: UserStore upserts a single row in SQLite.
+
+Usage: python bench/bench_user_store.py [--users 100 1000 10000] [--writes 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage import UserStore  # noqa: E402
+
+
+def make_users(count):
+    return {
+        str(100000 + i): {
+            'language': 'en',
+            'wallets': [f"0x{i:040x}", f"0x{i + 1:040x}"],
+            'monitor_threshold': 5.0,
+            'notification_interval': 4,
+            'monitoring_active': i % 2 == 0,
+        }
+        for i in range(count)
+    }
+
+
+def bench_json(directory, users, writes):
+    path = os.path.join(directory, 'user_data.json')
+    start = time.perf_counter()
+    for i in range(writes):
+        users['100000']['monitor_threshold'] = float(i)
+        with open(path, 'w') as f:
+            json.dump(users, f)
+    return (time.perf_counter() - start) / writes
+
+
+async def bench_sqlite(directory, users, writes):
+    store = UserStore(os.path.join(directory, 'user_data.db'))
+    store.open()
+    with store.conn:
+        store.conn.executemany(
+            'INSERT INTO users (user_id, monitoring_active, data) VALUES (?, ?, ?)',
+            [(user_id, int(data['monitoring_active']), json.dumps(data)) for user_id, data in users.items()]
+        )
+    start = time.perf_counter()
+    for i in range(writes):
+        users['100000']['monitor_threshold'] = float(i)
+        await store.save_user('100000', users['100000'])
+    elapsed = (time.perf_counter() - start) / writes
+    store.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--writes', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'json write (ms)':>16} {'sqlite write (ms)':>18}")
+    for count in args.users:
+        users = make_users(count)
+        with tempfile.TemporaryDirectory() as directory:
+            json_cost = bench_json(directory, users, args.writes)
+            sqlite_cost = asyncio.run(bench_sqlite(directory, users, args.writes))
+        print(f"{count:>8} {json_cost * 1000:>16.3f} {sqlite_cost * 1000:>18.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Local stand-in for the prices.curve.fi lending endpoints.
+
+Serves /v1/lending/markets/{chain}, /v1/lending/users/{chain}/{wallet} and the
+per-position /stats and /snapshots endpoints with deterministic data, adding
+configurable latency (with an optional slow tail), error rate and snapshot
+payload size. Every request is
+counted per endpoint.
+
+The wallet lists include markets whose loan was repaid (closed_fraction); their
+stats report zero debt. Health is spread between 8 and 90, except for a share
+of positions (at_risk_fraction) kept just above a threshold of 5, which the
+monitor checks every minute or so rather than every few minutes to an hour.
+
+A crash can be triggered with crash(): from then on a fraction of positions
+report a health below the crash level, which lets scenarios measure how long
+alerts take to arrive.
+
+Run standalone: python bench/fake_curve_api.py --port 8700
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+CHAINS = ['arbitrum', 'ethereum']
+
+
+def stable_random(*parts):
+    """Random generator seeded from the given parts, so the same position always gets the same data."""
+    digest = hashlib.sha256('/'.join(str(part) for part in parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+class FakeCurveAPI:
+    def __init__(self, markets_per_chain=40, markets_per_wallet=(1, 4), latency=0.05, jitter=0.05,
+                 error_rate=0.0, snapshots=200, crash_fraction=0.2, crash_health=2.0, closed_fraction=0.1,
+                 slow_fraction=0.0, slow_latency=2.0, at_risk_fraction=0.0, at_risk_health=(5.5, 6.5)):
+        self.markets_per_chain = markets_per_chain
+        self.markets_per_wallet = markets_per_wallet
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_fraction = slow_fraction  # Share of requests answered after slow_latency instead
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.snapshots = snapshots
+        self.crash_fraction = crash_fraction
+        self.crash_health = crash_health
+        self.closed_fraction = closed_fraction
+        self.at_risk_fraction = at_risk_fraction
+        self.at_risk_health = at_risk_health
+        self.crashed_at = None
+        self.requests = Counter()
+        self.errors = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner = None
+        self.url = None
+        self.controller_lists = {}  # chain -> controllers, computed once
+
+    def controllers(self, chain):
+        if chain not in self.controller_lists:
+            self.controller_lists[chain] = [f"0x{hashlib.sha256(f'{chain}/{i}'.encode()).hexdigest()[:40]}"
+                                            for i in range(self.markets_per_chain)]
+        return self.controller_lists[chain]
+
+    def wallet_markets(self, chain, wallet):
+        rng = stable_random('wallet', chain, wallet.lower())
+        count = rng.randint(*self.markets_per_wallet)
+        return rng.sample(self.controllers(chain), min(count, self.markets_per_chain))
+
+    def crash(self):
+        self.crashed_at = time.monotonic()
+
+    def is_crashed(self, chain, wallet, controller):
+        if self.crashed_at is None:
+            return False
+        return stable_random('crash', chain, wallet.lower(), controller).random() < self.crash_fraction
+
+    def is_closed(self, chain, wallet, controller):
+        return stable_random('closed', chain, wallet.lower(), controller).random() < self.closed_fraction
+
+    def is_at_risk(self, chain, wallet, controller):
+        return stable_random('at_risk', chain, wallet.lower(), controller).random() < self.at_risk_fraction
+
+    def base_health(self, chain, wallet, controller):
+        """Health of a position before any crash and drift."""
+        rng = stable_random('health', chain, wallet.lower(), controller)
+        return rng.uniform(*self.at_risk_health) if self.is_at_risk(chain, wallet, controller) else rng.uniform(8, 90)
+
+    def health(self, chain, wallet, controller):
+        if self.is_crashed(chain, wallet, controller):
+            return self.crash_health
+        # Slow drift so repeated polls see small changes, too small to take positions at risk below 5
+        drift = 0.5 if self.is_at_risk(chain, wallet, controller) else 2
+        return round(self.base_health(chain, wallet, controller) + drift * ((time.time() / 600) % 1 - 0.5), 4)
+
+    async def handle(self, request, endpoint, build):
+        self.requests[endpoint] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if random.random() < self.slow_fraction:
+                await asyncio.sleep(self.slow_latency)
+            else:
+                await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            if random.random() < self.error_rate:
+                self.errors[endpoint] += 1
+                return web.json_response({'detail': 'Internal error'}, status=500)
+            return web.json_response(build(request))
+        finally:
+            self.in_flight -= 1
+
+    def markets(self, request):
+        chain = request.match_info['chain']
+        return {'chain': chain, 'page': 1, 'per_page': 100, 'count': self.markets_per_chain, 'data': [
+            self.market(chain, i, controller) for i, controller in enumerate(self.controllers(chain))
+        ]}
+
+    @staticmethod
+    def market(chain, i, controller):
+        """One market in the shape of the real API, most of whose fields the bot never reads."""
+        rng = stable_random('market', controller)
+        address = lambda kind: f"0x{hashlib.sha256(f'{kind}/{controller}'.encode()).hexdigest()[:40]}"  # noqa: E731
+        token = lambda kind, symbol, decimals: {'symbol': symbol, 'address': address(kind), 'decimals': decimals,  # noqa: E731
+                                                'rebasing': False, 'usd_price': round(rng.uniform(0.5, 4000), 6)}
+        return {
+            'name': f"market-{i}", 'controller': controller, 'borrow_apy': round(stable_random(controller).uniform(1, 30), 4),
+            'vault': address('vault'), 'llamma': address('amm'), 'policy': address('policy'), 'oracle': address('oracle'),
+            'oracle_pools': [address('pool')], 'rate': rng.random() * 1e-9, 'lend_apy': 1.0, 'lend_apr': 1.0,
+            'borrow_apr': 1.0, 'n_loans': rng.randint(0, 5000), 'price_oracle': rng.uniform(1000, 4000),
+            'amm_price': rng.uniform(1000, 4000), 'base_price': rng.uniform(1000, 4000), 'total_debt': 1e6,
+            'total_assets': 2e6, 'total_debt_usd': 1e6, 'total_assets_usd': 2e6, 'minted': 3e6, 'redeemed': 2e6,
+            'minted_usd': 3e6, 'redeemed_usd': 2e6, 'loan_discount': 0.09, 'liquidation_discount': 0.06,
+            'min_band': rng.randint(-100, 0), 'max_band': rng.randint(0, 100), 'collateral_balance': rng.uniform(0, 1e4),
+            'borrowed_balance': rng.uniform(0, 1e6), 'collateral_balance_usd': rng.uniform(0, 1e7),
+            'borrowed_balance_usd': rng.uniform(0, 1e6), 'collateral_token': token('collateral', 'WETH', 18),
+            'borrowed_token': token('borrowed', 'crvUSD', 18), 'leverage': rng.uniform(1, 10),
+            'extra_reward_apr': [], 'created_at': '2024-01-01T00:00:00', 'max_ltv': 0.9, 'chain': chain,
+        }
+
+    def user_markets(self, request):
+        chain, wallet = request.match_info['chain'], request.match_info['wallet']
+        return {'user': wallet, 'page': 1, 'per_page': 10, 'count': 0, 'markets': [
+            {'market_name': f"market-{self.controllers(chain).index(controller)}", 'controller': controller,
+             'first_snapshot': '2024-01-01T00:00:00', 'last_snapshot': '2024-06-01T00:00:00'}
+            for controller in self.wallet_markets(chain, wallet)
+        ]}
+
+    def stats(self, request):
+        return self.position_stats(*(request.match_info[name] for name in ('chain', 'wallet', 'controller')))
+
+    def position_stats(self, chain, wallet, controller):
+        rng = stable_random('stats', chain, wallet.lower(), controller)
+        if self.is_closed(chain, wallet, controller):
+            return {'health': 0.0, 'health_full': 0.0, 'n1': 0, 'n2': 0, 'n': 0, 'debt': 0.0, 'collateral': 0.0,
+                    'borrowed': 0.0, 'soft_liquidation': False, 'total_deposit': 0.0, 'loss': 0.0, 'loss_pct': 0.0,
+                    'oracle_price': round(rng.uniform(1000, 4000), 2), 'block_number': int(time.time() / 12),
+                    'last_updated': '2024-06-01T00:00:00'}
+        health = self.health(chain, wallet, controller)
+        debt = round(rng.uniform(100, 1e6), 2)
+        oracle_price = round(rng.uniform(1000, 4000), 2)
+        # Collateral worth (1 + health) times the debt after a 6% liquidation discount, as before any crash
+        collateral = debt * (1 + self.base_health(chain, wallet, controller) / 100)
+        return {'health': health / 100, 'health_full': health, 'n1': 10, 'n2': 13, 'n': 4,
+                'debt': debt, 'collateral': round(collateral / (oracle_price * 0.94), 4),
+                'borrowed': 0.0, 'soft_liquidation': health < 3, 'total_deposit': 0.0,
+                'loss': 0.0, 'loss_pct': 0.0, 'oracle_price': oracle_price,
+                'block_number': int(time.time() / 12), 'last_updated': '2024-06-01T00:00:00'}
+
+    def position_snapshots(self, request):
+        chain, wallet, controller = (request.match_info[name] for name in ('chain', 'wallet', 'controller'))
+        start = int(request.query.get('start', 0))
+        now = int(time.time())
+        rng = stable_random('snapshots', chain, wallet.lower(), controller)
+        base = rng.uniform(8, 90)
+        data = []
+        for i in range(self.snapshots):
+            timestamp = now - (self.snapshots - i) * 3600
+            if timestamp < start:
+                continue
+            data.append({'timestamp': timestamp, 'health_full': round(base + rng.uniform(-2, 2), 4), 'health': base / 100,
+                         'debt': 1000.0, 'collateral': 1.0, 'oracle_price': 2000.0, 'n1': 10, 'n2': 13, 'n': 4,
+                         'soft_liquidation': False, 'loss': 0.0, 'loss_pct': 0.0, 'block_number': timestamp // 12})
+        return {'chain': chain, 'user': wallet, 'controller': controller, 'data': data}
+
+    def app(self):
+        app = web.Application()
+        routes = [
+            ('/v1/lending/markets/{chain}', 'markets', self.markets),
+            ('/v1/lending/users/{chain}/{wallet}', 'positions', self.user_markets),
+            ('/v1/lending/users/{chain}/{wallet}/{controller}/stats', 'stats', self.stats),
+            ('/v1/lending/users/{chain}/{wallet}/{controller}/snapshots', 'snapshots', self.position_snapshots),
+        ]
+        for path, endpoint, build in routes:
+            app.router.add_get(path, lambda request, endpoint=endpoint, build=build: self.handle(request, endpoint, build))
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--snapshots', type=int, default=200)
+    parser.add_argument('--markets', type=int, default=40, help='markets per chain')
+    parser.add_argument('--crash-fraction', type=float, default=0.2)
+    parser.add_argument('--crashed', action='store_true', help='start with the crash already happened')
+    parser.add_argument('--reuse-port', action='store_true', help='let several processes serve the same port')
+    args = parser.parse_args()
+
+    api = FakeCurveAPI(markets_per_chain=args.markets, latency=args.latency, error_rate=args.error_rate,
+                       snapshots=args.snapshots, crash_fraction=args.crash_fraction)
+    if args.crashed:
+        api.crash()
+    web.run_app(api.app(), host='127.0.0.1', port=args.port, reuse_port=args.reuse_port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Local stand-in for a JSON-RPC node with Multicall3 and the Curve lending contracts.
+
+Answers eth_call to Multicall3.aggregate3 (and eth_blockNumber) at
+/{chain}, decoding every inner call and serving the same positions as a
+FakeCurveAPI: health, user_state and price_oracle are derived from its stats,
+so both position sources see the same data and a crash() of the API shows up
+here too. Every eth_call and inner call is counted.
+
+Run standalone: python bench/fake_rpc_node.py --port 8701
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_curve_api import FakeCurveAPI  # noqa: E402
+from position_sources import (MULTICALL3_ADDRESS, SELECTORS, decode_address, decode_aggregate3_calls,  # noqa: E402
+                              encode_aggregate3_result, encode_word)
+
+FUNCTIONS = {selector: name for name, selector in SELECTORS.items()}
+
+
+def derived_address(*parts):
+    return '0x' + hashlib.sha256('/'.join(parts).encode()).hexdigest()[:40]
+
+
+class Revert(Exception):
+    pass
+
+
+class FakeRpcNode:
+    def __init__(self, api, latency=0.05, jitter=0.02, error_rate=0.0):
+        self.api = api
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = Counter()  # JSON-RPC method -> count
+        self.calls = Counter()  # Inner call function -> count
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner = None
+        self.url = None
+        self.contracts = {}  # address -> (kind, chain, controller)
+        for chain in ('arbitrum', 'ethereum'):
+            for i, controller in enumerate(api.controllers(chain)):
+                self.contracts[controller] = ('controller', chain, controller)
+                self.contracts[derived_address('amm', controller)] = ('amm', chain, controller)
+                self.contracts[derived_address('collateral', controller)] = ('collateral', chain, controller)
+                if i % 2 == 0:  # Odd markets stand in for crvUSD mint markets without borrowed_token()
+                    self.contracts[derived_address('borrowed', controller)] = ('borrowed', chain, controller)
+
+    @staticmethod
+    def collateral_decimals(controller):
+        return 8 if int(controller[-1], 16) % 4 == 0 else 18
+
+    def block_number(self):
+        return int(time.time() / 12)
+
+    def position(self, chain, wallet, controller):
+        """Stats of an open loan, None if the wallet has none in the market."""
+        if controller not in self.api.wallet_markets(chain, wallet) or self.api.is_closed(chain, wallet, controller):
+            return None
+        return self.api.position_stats(chain, wallet, controller)
+
+    def call(self, target, calldata):
+        """Return data of one inner call, raising Revert where the contract would revert."""
+        name = FUNCTIONS.get(calldata[:4].hex())
+        self.calls[name] += 1
+        args = calldata[4:]
+        if target == MULTICALL3_ADDRESS.lower() and name == 'getBlockNumber':
+            return encode_word(self.block_number())
+        if target not in self.contracts:
+            raise Revert()
+        kind, chain, controller = self.contracts[target]
+        if kind == 'controller':
+            if name == 'amm':
+                return encode_word(derived_address('amm', controller))
+            if name == 'collateral_token':
+                return encode_word(derived_address('collateral', controller))
+            if name == 'borrowed_token' and derived_address('borrowed', controller) in self.contracts:
+                return encode_word(derived_address('borrowed', controller))
+            if name in ('health', 'user_state'):
+                stats = self.position(chain, decode_address(args), controller)
+                if name == 'health':
+                    if stats is None:
+                        raise Revert()
+                    return encode_word(int(stats['health_full'] * 1e16))
+                if stats is None:
+                    return b''.join(encode_word(0) for _ in range(4))
+                borrowed = stats['debt'] * 0.1 if stats['soft_liquidation'] else 0
+                return (encode_word(int(stats['collateral'] * 10 ** self.collateral_decimals(controller)))
+                        + encode_word(int(borrowed * 1e18)) + encode_word(int(stats['debt'] * 1e18))
+                        + encode_word(stats['n']))
+        elif kind == 'amm':
+            if name == 'price_oracle':
+                # Same price for every position of a market
+                return encode_word(int(self.api.position_stats(chain, controller, controller)['oracle_price'] * 1e18))
+            if name == 'read_user_tick_numbers':
+                stats = self.position(chain, decode_address(args), controller)
+                return encode_word(stats['n1'] if stats else 0) + encode_word(stats['n2'] if stats else 0)
+        elif name == 'decimals':
+            return encode_word(self.collateral_decimals(controller) if kind == 'collateral' else 18)
+        raise Revert()
+
+    def aggregate3(self, calldata):
+        results = []
+        for target, allow_failure, inner in decode_aggregate3_calls(calldata):
+            try:
+                results.append((True, self.call(target.lower(), inner)))
+            except Revert:
+                if not allow_failure:
+                    raise
+                results.append((False, b''))
+        return encode_aggregate3_result(results)
+
+    def dispatch(self, message):
+        method = message.get('method')
+        self.requests[method] += 1
+        if method == 'eth_blockNumber':
+            return hex(self.block_number())
+        if method == 'eth_call':
+            call = message['params'][0]
+            data = bytes.fromhex(call['data'][2:])
+            if call['to'].lower() != MULTICALL3_ADDRESS.lower() or FUNCTIONS.get(data[:4].hex()) != 'aggregate3':
+                raise Revert()
+            return '0x' + self.aggregate3(data).hex()
+        raise KeyError(method)
+
+    async def handle(self, request):
+        message = await request.json()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            if random.random() < self.error_rate:
+                return web.json_response({'error': 'Service unavailable'}, status=503)
+            try:
+                result = self.dispatch(message)
+            except Revert:
+                return web.json_response({'jsonrpc': '2.0', 'id': message.get('id'),
+                                          'error': {'code': 3, 'message': 'execution reverted'}})
+            except KeyError:
+                return web.json_response({'jsonrpc': '2.0', 'id': message.get('id'),
+                                          'error': {'code': -32601, 'message': 'Method not found'}})
+            return web.json_response({'jsonrpc': '2.0', 'id': message.get('id'), 'result': result})
+        finally:
+            self.in_flight -= 1
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/{chain}', self.handle)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    def rpc_urls(self):
+        return {chain: f"{self.url}/{chain}" for chain in ('arbitrum', 'ethereum')}
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8701)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    node = FakeRpcNode(FakeCurveAPI(), latency=args.latency, error_rate=args.error_rate)
+    web.run_app(node.app(), host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Shared pieces of the benchmark scenarios: fake Telegram objects, bot loading and measurements."""
+import asyncio
+import os
+import random
+import resource
+import socket
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import aiohttp  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+
+# Syntactically valid token so bot.py can be imported without a real bot
+FAKE_TOKEN = '123456789:AAFakeTokenForBenchmarksOnly0000000'
+
+
+class FakeBot:
+    """Records sent messages and can answer with flood control like Telegram does."""
+
+    def __init__(self, latency=0.02, flood_rate=0.0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.sent = []  # (monotonic time, chat_id, text)
+        self.floods = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.flood_rate:
+            self.floods += 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), 'Flood control exceeded', 1)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+    async def set_my_commands(self, commands, **kwargs):
+        return True
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeMessage:
+    """Stands in for an incoming aiogram Message, recording answers and edits."""
+
+    def __init__(self, user_id, text='', latency=0.02):
+        self.from_user = FakeUser(user_id)
+        self.text = text
+        self.latency = latency
+        self.answers = []
+        self.edits = []  # (monotonic time, text)
+
+    async def answer(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        reply = FakeMessage(self.from_user.id, text, self.latency)
+        self.answers.append(reply)
+        return reply
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.text = text
+        self.edits.append((time.monotonic(), text))
+
+
+class FakeCallbackQuery:
+    """Stands in for a press of an inline keyboard button under message."""
+
+    def __init__(self, user_id, data, message):
+        self.from_user = FakeUser(user_id)
+        self.data = data
+        self.message = message
+        self.answers = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+
+def load_bot(workdir, api_url):
+    """Import bot.py with its data files in workdir and its Curve API pointed at api_url."""
+    os.environ.setdefault('BOT_TOKEN', FAKE_TOKEN)
+    os.environ['CURVE_API_URL'] = api_url
+    os.environ['METRICS_PORT'] = '0'
+    os.chdir(workdir)
+    import bot
+    bot.curve_client.base_url = api_url
+    return bot
+
+
+def make_users(count, wallets_per_user=2, whale_wallets=20, whale_fraction=0.3, threshold=5.0, seed=1):
+    """User settings where a share of users also watch a few popular (whale) wallets."""
+    rng = random.Random(seed)
+    whales = [f"0x{rng.getrandbits(160):040x}" for _ in range(whale_wallets)]
+    users = {}
+    for i in range(count):
+        wallets = [f"0x{rng.getrandbits(160):040x}" for _ in range(wallets_per_user)]
+        if rng.random() < whale_fraction:
+            wallets.append(rng.choice(whales))
+        users[str(1000000 + i)] = {
+            'language': 'en',
+            'wallets': wallets,
+            'monitor_threshold': threshold,
+            'notification_interval': 1,
+            'monitoring_active': True,
+        }
+    return users
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+def percentile(values, fraction):
+    """Value at fraction of the sorted values, None if there are none."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def format_percentile(values, fraction, scale=1.0, unit='s', digits=2):
+    """A percentile for a report, 'n/a' rather than a made-up 0 when nothing was measured."""
+    value = percentile(values, fraction)
+    return 'n/a' if value is None else f"{value * scale:.{digits}f}{unit}"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_api(url, attempts=100):
+    """Wait until a fake Curve API started in another process answers, False if it never does."""
+    async with aiohttp.ClientSession() as session:
+        for _ in range(attempts):
+            try:
+                async with session.get(f"{url}/v1/lending/users/ethereum/0x0"):
+                    return True
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    return False
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(title, rows):
+    print(f"\n{title}")
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f"  {name:<{width}}  {value}")
@@ -0,0 +1,183 @@
+"""Run the position monitor against the fake Curve API with many users.
+
+Users watch their own wallets plus a few shared whale wallets. A share of
+positions (--at-risk) sits just above the alert threshold, so the monitor
+checks them about every minute. After --crash-after seconds the fake API
+drops the health of a share of positions below the threshold; the time until
+the first alert reaches each user with an at-risk position among them is the
+alert latency. Users alerted after the crash for other positions are counted
+but not part of the latency. Crashed positions far from the threshold are only checked
+again after up to an hour, beyond the end of a run.
+
+A monitoring pass is one check of every monitored position; passes are
+counted as position checks divided by monitored positions.
+
+With --source rpc position stats are read from a local stand-in JSON-RPC
+node (bench/fake_rpc_node.py) in Multicall3 batches instead of the /stats
+endpoint.
+
+Usage: python bench/scenario_monitor.py [--users 1000] [--duration 180] [--crash-after 60] [--at-risk 0.1] [--source rpc]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_curve_api import FakeCurveAPI  # noqa: E402
+from fake_rpc_node import FakeRpcNode  # noqa: E402
+from harness import FakeBot, LoopLagMonitor, format_percentile, load_bot, make_users, peak_rss_mb, report  # noqa: E402
+
+
+def histogram_count(histogram):
+    return sum(s[-1] for s in histogram.values.values())
+
+
+def histogram_mean(histogram):
+    series = list(histogram.values.values())
+    count = sum(s[-1] for s in series)
+    return sum(s[-2] for s in series) / count if count else 0.0
+
+
+def users_at_risk_in_crash(api, bot, users):
+    """Users watching a crashed position that the fake API keeps near the threshold."""
+    return {user_id for user_id, data in users.items()
+            if any(api.is_at_risk(chain, wallet, controller) and api.is_crashed(chain, wallet, controller)
+                   and not api.is_closed(chain, wallet, controller)
+                   for wallet in data['wallets'] for chain in bot.SUPPORTED_CHAINS
+                   for controller in api.wallet_markets(chain, wallet))}
+
+
+async def run(args):
+    api = FakeCurveAPI(latency=args.latency, error_rate=args.error_rate, snapshots=args.snapshots,
+                       at_risk_fraction=args.at_risk)
+    url = await api.start()
+    workdir = tempfile.mkdtemp(prefix='bench-monitor-')
+    bot = load_bot(workdir, url)
+
+    from scheduler import RequestBudget
+    from position_sources import RpcSource
+    import metrics
+
+    node = None
+    if args.source == 'rpc':
+        node = FakeRpcNode(api, latency=args.latency, error_rate=args.error_rate)
+        await node.start()
+        bot.POSITION_SOURCE = 'rpc'
+        bot.position_source = RpcSource(node.rpc_urls())
+
+    fake_bot = FakeBot()
+    bot.bot = fake_bot
+    bot.notifier.bot = fake_bot
+    bot.request_budget = RequestBudget(args.budget)
+
+    users = make_users(args.users, wallets_per_user=args.wallets)
+    for user_id, data in users.items():
+        dict.__setitem__(bot.user_data, user_id, data)
+    unique_wallets = {wallet.lower() for data in users.values() for wallet in data['wallets']}
+
+    await bot.health_store.open()
+    await bot.market_index_store.open()
+    await bot.curve_client.start()
+    await bot.position_source.start()
+    bot.notifier.start()
+    lag = LoopLagMonitor()
+    lag.start()
+
+    start = time.monotonic()
+    monitor = asyncio.create_task(bot.position_monitor())
+    await asyncio.sleep(args.crash_after)
+    before_crash = Counter(api.requests)
+    api.crash()
+    crash_time = time.monotonic()
+    await asyncio.sleep(args.duration - args.crash_after)
+    elapsed = time.monotonic() - start
+
+    monitor.cancel()
+    await asyncio.gather(monitor, return_exceptions=True)
+    await lag.stop()
+    await bot.notifier.stop()
+    await bot.position_source.close()
+    await bot.curve_client.close()
+    bot.health_store.close()
+    bot.market_index_store.close()
+    await api.stop()
+    if node is not None:
+        await node.stop()
+
+    first_alert = {}
+    for sent_at, chat_id, _ in fake_bot.sent:
+        if sent_at >= crash_time and chat_id not in first_alert:
+            first_alert[chat_id] = sent_at - crash_time
+    expected = users_at_risk_in_crash(api, bot, users)
+    alert_latencies = [first_alert[user_id] for user_id in expected if user_id in first_alert]
+    total = sum(api.requests.values())
+    positions = len(bot.monitored_positions)
+    passes = histogram_count(metrics.monitor_poll_duration) / positions if positions else 0
+    after_crash = {endpoint: api.requests[endpoint] - before_crash[endpoint] for endpoint in api.requests}
+
+    report('Setup', [
+        ('users', args.users),
+        ('unique wallets', len(unique_wallets)),
+        ('monitored positions', f"{positions} ({args.at_risk:.0%} near the threshold)"),
+        ('request budget', f"{args.budget}/s"),
+        ('fake API latency', f"{args.latency * 1000:.0f} ms, error rate {args.error_rate:.1%}"),
+        ('position source', args.source),
+    ])
+    report('Upstream requests', [
+        ('total', f"{total} in {elapsed:.0f}s ({total / elapsed * 60:.0f}/min)"),
+        ('by endpoint', dict(api.requests)),
+        ('after crash', after_crash),
+        ('per user', f"{total / args.users:.2f}"),
+        ('per monitoring pass', f"{total / passes:.0f} ({passes:.2f} passes)" if passes else 'n/a'),
+        ('max in flight', api.max_in_flight),
+    ] + ([
+        ('JSON-RPC requests', dict(node.requests)),
+        ('JSON-RPC calls', dict(node.calls)),
+        ('positions per eth_call', f"{histogram_mean(metrics.rpc_batch_size):.1f}"),
+        ('JSON-RPC max in flight', node.max_in_flight),
+    ] if node is not None else []))
+    report('Monitor', [
+        ('monitoring pass (mean)', f"{elapsed / passes:.1f}s" if passes else 'n/a'),
+        ('discovery duration (mean)', f"{histogram_mean(metrics.monitor_discovery_duration):.2f}s"),
+        ('position check (mean)', f"{histogram_mean(metrics.monitor_poll_duration) * 1000:.1f} ms"),
+        ('poll lag (mean)', f"{histogram_mean(metrics.monitor_poll_lag):.2f}s"),
+    ])
+    report('Alerts', [
+        ('users with an at-risk position crashed', len(expected)),
+        ('users alerted after crash', f"{len(first_alert)} ({len(alert_latencies)} of them)"),
+        ('messages sent', len(fake_bot.sent)),
+        ('alert latency p50', format_percentile(alert_latencies, 0.5)),
+        ('alert latency p99', format_percentile(alert_latencies, 0.99)),
+    ])
+    report('Process', [
+        ('event loop lag p50', format_percentile(lag.samples, 0.5, 1000, ' ms', 1)),
+        ('event loop lag p99', format_percentile(lag.samples, 0.99, 1000, ' ms', 1)),
+        ('event loop lag max', f"{max(lag.samples, default=0) * 1000:.1f} ms"),
+        ('peak RSS', f"{peak_rss_mb():.0f} MB"),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--wallets', type=int, default=2, help='own wallets per user')
+    parser.add_argument('--duration', type=float, default=180, help='seconds to run the monitor')
+    parser.add_argument('--crash-after', type=float, default=60,
+                        help='seconds before the simulated crash, after the first check of every position')
+    parser.add_argument('--at-risk', type=float, default=0.1, help='share of positions just above the threshold')
+    parser.add_argument('--budget', type=float, default=200, help='monitor requests per second')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake API latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--snapshots', type=int, default=200, help='snapshots per position')
+    parser.add_argument('--source', choices=['api', 'rpc'], default='api', help='where position stats come from')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Drive /pos for many users against the fake Curve API.
+
+Each user sends /pos, then presses the next page button --pages times. The
+latency of each is the time until the status message is edited. Reports
+upstream requests per first page and per page turn, latency percentiles,
+event-loop lag and memory.
+
+Usage: python bench/scenario_pos.py [--users 200] [--concurrency 50] [--wallets 5] [--pages 1]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_curve_api import FakeCurveAPI  # noqa: E402
+from harness import FakeBot, FakeCallbackQuery, FakeMessage, LoopLagMonitor, format_percentile, load_bot, make_users, peak_rss_mb, report  # noqa: E402
+
+
+async def run(args):
+    api = FakeCurveAPI(latency=args.latency, error_rate=args.error_rate, snapshots=args.snapshots)
+    url = await api.start()
+    workdir = tempfile.mkdtemp(prefix='bench-pos-')
+    bot = load_bot(workdir, url)
+    bot.bot = FakeBot()
+
+    users = make_users(args.users, wallets_per_user=args.wallets)
+    for user_id, data in users.items():
+        dict.__setitem__(bot.user_data, user_id, data)
+
+    await bot.health_store.open()
+    await bot.market_index_store.open()
+    await bot.curve_client.start()
+    lag = LoopLagMonitor()
+    lag.start()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    page_latencies = []
+    statuses = {}
+
+    async def pos(user_id):
+        async with semaphore:
+            message = FakeMessage(int(user_id))
+            start = time.monotonic()
+            await bot.cmd_pos(message)
+            status = statuses[user_id] = message.answers[-1]
+            latencies.append(status.edits[-1][0] - start if status.edits else 0.0)
+
+    async def next_page(user_id, page):
+        async with semaphore:
+            status = statuses[user_id]
+            start = time.monotonic()
+            data = bot.pos_callback_data(bot.pos_sessions[user_id], 'page', page)
+            await bot.process_callback_pos(FakeCallbackQuery(int(user_id), data, status))
+            page_latencies.append(status.edits[-1][0] - start)
+
+    start = time.monotonic()
+    await asyncio.gather(*(pos(user_id) for user_id in users))
+    elapsed = time.monotonic() - start
+    first_page_requests = sum(api.requests.values())
+    for page in range(1, args.pages + 1):
+        await asyncio.gather(*(next_page(user_id, page) for user_id in users))
+    page_turns = args.users * args.pages
+
+    await lag.stop()
+    await bot.curve_client.close()
+    bot.health_store.close()
+    bot.market_index_store.close()
+    await api.stop()
+
+    total = sum(api.requests.values())
+    report('Setup', [
+        ('users', args.users),
+        ('wallets per user', args.wallets),
+        ('concurrent /pos', args.concurrency),
+        ('fake API latency', f"{args.latency * 1000:.0f} ms, error rate {args.error_rate:.1%}"),
+    ])
+    report('Upstream requests', [
+        ('total', total),
+        ('by endpoint', dict(api.requests)),
+        ('per /pos', f"{first_page_requests / args.users:.1f} ({first_page_requests} in {elapsed:.1f}s)"),
+        ('per page turn', f"{(total - first_page_requests) / page_turns:.1f}" if page_turns else '-'),
+        ('cache', bot.curve_client.cache_stats()),
+    ])
+    report('/pos latency', [
+        ('p50', format_percentile(latencies, 0.5)),
+        ('p99', format_percentile(latencies, 0.99)),
+        ('page turn p50', format_percentile(page_latencies, 0.5)),
+        ('page turn p99', format_percentile(page_latencies, 0.99)),
+    ])
+    report('Process', [
+        ('event loop lag p50', format_percentile(lag.samples, 0.5, 1000, ' ms', 1)),
+        ('event loop lag p99', format_percentile(lag.samples, 0.99, 1000, ' ms', 1)),
+        ('event loop lag max', f"{max(lag.samples, default=0) * 1000:.1f} ms"),
+        ('peak RSS', f"{peak_rss_mb():.0f} MB"),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--wallets', type=int, default=5, help='own wallets per user')
+    parser.add_argument('--concurrency', type=int, default=50, help='/pos commands running at once')
+    parser.add_argument('--pages', type=int, default=1, help='next page presses per user after /pos')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake API latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--snapshots', type=int, default=200, help='snapshots per position')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
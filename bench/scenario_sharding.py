@@ -0,0 +1,145 @@
+"""Measure how monitoring throughput grows with the number of shard workers.
+
+For each worker count a ShardCoordinator runs in this process and the workers
+run as separate processes, like sharding.spawn_workers starts them. The fake
+Curve API runs in --api-processes processes sharing one port, so it is not
+limited to one core either. Every position has crashed before the workers
+start, so the first check of each open position sends an alert back to the
+coordinator. Throughput is positions checked per second until every open
+position has alerted, from the moment all workers have their assignment.
+
+Throughput can only grow while there are idle cores for the extra workers;
+the report states how many the machine has.
+
+Usage: python bench/scenario_sharding.py [--workers 1 2 4] [--users 1000] [--api-processes 2]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_curve_api import FakeCurveAPI  # noqa: E402
+from harness import free_port, load_bot, make_users, report, wait_for_api  # noqa: E402
+
+from chains import load_chains  # noqa: E402
+from scheduler import RequestBudget  # noqa: E402
+import sharding  # noqa: E402
+
+
+def open_positions(users):
+    """Position keys the workers should alert on, as the bot builds them."""
+    api = FakeCurveAPI()
+    wallets = {wallet for data in users.values() for wallet in data['wallets']}
+    return {f"{chain}_{wallet}_{controller}" for wallet in wallets for chain in load_chains()
+            for controller in api.wallet_markets(chain, wallet) if not api.is_closed(chain, wallet, controller)}
+
+
+async def start_api(args):
+    port = free_port()
+    processes = [subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_curve_api.py'), '--port', str(port),
+                                   '--reuse-port', '--crashed', '--crash-fraction', '1', '--latency', str(args.latency),
+                                   '--snapshots', str(args.snapshots)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for _ in range(args.api_processes)]
+    url = f"http://127.0.0.1:{port}"
+    if not await wait_for_api(url):
+        for process in processes:
+            process.kill()
+        raise RuntimeError('fake API did not start')
+    return processes, url
+
+
+async def run_shards(args, url, count, users, expected):
+    """Seconds until every expected position alerted with count workers, and the positions that did."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-shards-{count}-")
+    alerted = {}
+    user_data = {}
+    coordinator = sharding.ShardCoordinator(user_data, lambda chat_id, key, text: alerted.setdefault(key, time.monotonic()),
+                                            lambda rows: None, port=free_port())
+    await coordinator.start()
+    with open(os.path.join(workdir, 'workers.log'), 'w') as log:
+        workers = [await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--worker-id', f"worker-{i}", '--port', str(coordinator.port),
+            '--api-url', url, '--budget', str(args.budget), '--concurrency', str(args.concurrency),
+            cwd=workdir, stdout=subprocess.DEVNULL, stderr=log) for i in range(count)]
+    try:
+        # Hand out the users only once every worker is there, so none of them starts with everything
+        while len(coordinator.workers) < count:
+            await asyncio.sleep(0.1)
+        user_data.update(users)
+        start = time.monotonic()
+        await coordinator.rebalance()
+        deadline = start + args.timeout
+        while len(expected & alerted.keys()) < len(expected) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        checked = expected & alerted.keys()
+        return max((alerted[key] for key in checked), default=start) - start, len(checked)
+    finally:
+        await sharding.stop_workers(workers)
+        await coordinator.stop()
+
+
+async def run(args):
+    users = make_users(args.users)
+    expected = open_positions(users)
+    processes, url = await start_api(args)
+    rows = []
+    try:
+        base = None
+        for count in args.workers:
+            elapsed, checked = await run_shards(args, url, count, users, expected)
+            rate = checked / elapsed if elapsed else 0.0
+            base = base or rate
+            rows.append((f"{count} workers", f"{checked}/{len(expected)} positions in {elapsed:.1f}s, "
+                                              f"{rate:.0f} checks/s, {rate / base:.2f}x"))
+    finally:
+        for process in processes:
+            process.kill()
+
+    report('Setup', [
+        ('users', args.users),
+        ('open positions', len(expected)),
+        ('CPU cores', os.cpu_count()),
+        ('fake API', f"{args.api_processes} processes, {args.latency * 1000:.0f} ms latency"),
+        ('limits', f"{args.budget:.0f} requests/s across all workers, {args.concurrency} in flight per worker"),
+    ])
+    report('Throughput', rows)
+
+
+def run_worker(args):
+    """Worker process: the bot's monitor pointed at the fake API, with the scenario's limits."""
+    bot = load_bot(os.getcwd(), args.api_url)
+    bot.request_budget = RequestBudget(args.budget)
+    bot.MONITOR_CONCURRENCY = args.concurrency
+    asyncio.run(sharding.run_worker(args.worker_id, port=args.port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to compare')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--api-processes', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.01, help='fake API latency in seconds')
+    parser.add_argument('--snapshots', type=int, default=50, help='snapshots per position')
+    parser.add_argument('--budget', type=float, default=10000, help='requests per second across all workers')
+    parser.add_argument('--concurrency', type=int, default=100, help='requests in flight per worker')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for every position per run')
+    # Worker mode, used by the scenario itself
+    parser.add_argument('--worker-id')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--api-url')
+    args = parser.parse_args()
+    if args.worker_id:
+        run_worker(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
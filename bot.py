@@ -1,44 +1,188 @@
 import json
+import math
 import os
 import asyncio
+import time
+import random
+import hashlib
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import BotCommand, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
-import aiohttp
+from aiogram.exceptions import TelegramBadRequest
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from chains import load_chains, chain_limits
+from curve_client import CurveClient
+from position_sources import create_position_source
+from records import intern_key, intern_markets, intern_text
+from storage import UserStore, UserData, HealthStore, MonitorStateStore, MarketIndexStore
+import metrics
+import sharding
+import stress
+from notifier import Notifier, split_message, MESSAGE_LIMIT
+from scheduler import PollScheduler, RequestBudget, poll_interval, MAX_POLL_INTERVAL, ERROR_POLL_INTERVAL
+
+STARTED_AT = time.monotonic()
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Load and save user data
-DATA_FILE = 'user_data.json'
+DATA_FILE = 'user_data.json'  # Legacy whole-file store, migrated into USER_DB_FILE on startup
+USER_DB_FILE = 'user_data.db'
 
 # File to store borrow rates
 BORROW_RATES_FILE = 'borrow_rates.json'
+BORROW_RATES_INTERVAL = 900  # Seconds between borrow rate updates
+BORROW_RATES_STALE_AFTER = 3600  # Rates older than this are flagged as stale
+
+# Supported chains, from the chain registry (a chains.json file overrides the defaults)
+CHAINS = load_chains()
+SUPPORTED_CHAINS = list(CHAINS)
+
+# Market index settings
+MARKET_INDEX_DB_FILE = 'market_index.db'
+MARKET_INDEX_MAX_AGE = 6 * 3600  # Seconds before the markets of a wallet are looked up again
+
+# Monitoring settings
+DISCOVERY_INTERVAL = 300  # Seconds between updates of the monitored positions from the market index
+MONITOR_CONCURRENCY = 20  # Simultaneous Curve API requests of the monitor
+MONITOR_REQUEST_BUDGET = 10  # Curve API requests per second the monitor may make
+
+# Source of position stats: 'api' (prices.curve.fi) or 'rpc' (lending controllers over JSON-RPC, see RPC_URLS)
+POSITION_SOURCE = os.environ.get('POSITION_SOURCE', 'api')
+RPC_MONITOR_CONCURRENCY = 1000  # Position checks in progress with the 'rpc' source, batched into a few eth_calls
+RPC_MONITOR_BUDGET = 500  # Position checks per second with the 'rpc' source
+
+# Port of the local Prometheus metrics endpoint (0 disables it)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', metrics.METRICS_PORT))
+
+# Number of monitoring worker processes (0 runs monitoring in this process)
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', '0'))
+SHARD_PORT = int(os.environ.get('SHARD_PORT', sharding.SHARD_PORT))
 
-# Supported chains
-SUPPORTED_CHAINS = ['arbitrum', 'ethereum']
+# Warm start settings
+MONITOR_STATE_DB_FILE = 'monitor_state.db'
+STARTUP_SPREAD = 300  # Seconds over which the first checks of restored positions are spread
+STATE_FLUSH_INTERVAL = 30  # Seconds between saves of the monitor state
+STATE_RETENTION = 7 * 86400  # Positions not checked for this long are forgotten, with their saved notifications
 
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'r') as f:
-        user_data = json.load(f)
-else:
-    user_data = {}
+# Health history settings
+HEALTH_DB_FILE = 'health.db'
+HEALTH_CHANGE_WINDOWS = [3600, 86400, 7 * 86400]  # Windows of the reported health change: 1h, 24h, 7d
+HEALTH_HISTORY_RETENTION = 8 * 86400  # Seconds of health history to keep
+SNAPSHOT_SYNC_INTERVAL = 3600  # Minimum seconds between snapshot syncs of one position
+SNAPSHOT_FIELDS = ('data', 'timestamp', 'health_full', 'debt', 'oracle_price')  # Fields decoded from snapshot responses
 
-def save_user_data():
-    with open(DATA_FILE, 'w') as f:
-        json.dump(user_data, f)
+# /pos settings
+POS_CONCURRENCY = 10  # Simultaneous Curve API requests per /pos command
+POS_PAGE_SIZE = 5  # Positions per /pos page
+POS_STATS_MAX_AGE = 60  # Seconds stats already read are shown on /pos pages without a new request
+POS_SESSION_TTL = 3600  # Seconds a /pos listing answers its buttons after the last use
+POS_MAX_SESSIONS = 10000  # Open /pos listings kept, the least recently used are dropped
+
+# /stress settings
+STRESS_SHOCKS = [-0.05, -0.1, -0.2, -0.3, -0.4, -0.5]  # Collateral price moves shown for each position
+STRESS_REPORT_SHOCKS = [-0.05 * i for i in range(1, 11)]  # Price moves of the operator report over all positions
+OPERATOR_IDS = {user_id.strip() for user_id in os.environ.get('OPERATOR_IDS', '').split(',') if user_id.strip()}
+
+user_store = UserStore(USER_DB_FILE)
+user_data = UserData(user_store)  # Filled in main() and on first access per user
+health_store = HealthStore(HEALTH_DB_FILE)
+monitor_state_store = MonitorStateStore(MONITOR_STATE_DB_FILE)
+market_index_store = MarketIndexStore(MARKET_INDEX_DB_FILE)
+
+def open_user_store():
+    user_store.open()
+    user_store.migrate_json(DATA_FILE)
+    user_data.load_active()
+
+def replace_user_data(users):
+    """Swap in a new set of users, used by shard workers when wallets are reassigned."""
+    dict.clear(user_data)
+    user_data.missing.clear()
+    for user_id, data in users.items():
+        dict.__setitem__(user_data, user_id, data)
+
+async def user_settings_changed(user_id, wallets_changed=False):
+    """Let the monitor pick up new wallets or thresholds of a user right away.
+
+    When the wallets changed their markets are looked up again instead of read from the market index.
+    With shard workers the front-end does that lookup and hands the markets to the workers.
+    """
+    if shard_coordinator is not None:
+        if wallets_changed:
+            asyncio.create_task(refresh_shard_user(user_id))
+        else:
+            await shard_coordinator.user_changed(user_id)
+        return
+    if user_data.get(user_id, {}).get('monitoring_active', False):
+        asyncio.create_task(discover_positions([user_id], refresh=wallets_changed))
+        return
+    if wallets_changed:
+        asyncio.create_task(refresh_wallet_markets(user_data.get(user_id, {}).get('wallets', [])))
+
+async def save_user_data(user_id):
+    try:
+        await user_store.save_user(user_id, user_data[user_id])
+    except Exception as e:
+        logger.error(f"Failed to save settings of user {user_id}: {e}")
 
 # Bot initialization
-bot = Bot(token="YOUR_TOKEN")
+bot = Bot(token=os.environ.get("BOT_TOKEN", "YOUR_TOKEN"))
+curve_client = CurveClient()  # Shared HTTP client for the Curve API, started in main()
+api_limits = chain_limits(CHAINS)  # Per-chain limits on simultaneous Curve API requests
+position_source = create_position_source(POSITION_SOURCE, curve_client, CHAINS, api_limits)  # Started in main()
+notifier = Notifier(bot)  # Outbound queue for alerts, started in main()
+shard_coordinator = None  # Hands monitoring to worker processes when SHARD_WORKERS > 0
+metrics.Gauge('curve_api_pool', 'Curve API connection pool statistics.', ['stat'],
+              callback=lambda: {(name,): value for name, value in curve_client.pool_stats().items()})
+metrics.Gauge('curve_api_cache', 'Curve API response cache statistics.', ['stat'],
+              callback=lambda: {(name,): value for name, value in curve_client.cache_stats().items()})
+metrics.Gauge('curve_api_circuit_open', 'Whether the circuit breaker of a Curve API endpoint refuses calls.',
+              ['endpoint'], callback=lambda: {(endpoint,): int(state != 'closed')
+                                              for endpoint, state in curve_client.breaker_states().items()})
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+# Markets of each wallet: (chain, wallet) -> (looked_up_at, {controller: market_name}), loaded in main()
+market_index = {}
+market_index_forwarder = None  # Shard workers pass their lookups on to the front-end through this
+# Open /pos listings, least recently used first:
+# user_id -> {'id', 'positions': [(chain, wallet, controller, market_name)] most at risk first, 'page', 'used_at'}
+pos_sessions = OrderedDict()
+# Monitored positions: (chain, wallet, controller) -> market_name, and (chain, wallet) -> subscribed user_ids
+monitored_positions = {}
+monitor_subscriptions = {}
+# (timestamp, health) of the previous check per position, used for the rate of health change
+health_trend = {}
+# Monitor state changed since the last save: (user_id, position_key) -> sent_at and key -> (market_name, stats, updated_at)
+dirty_notifications = {}
+dirty_positions = {}
+# Restored positions that have not been checked yet after a restart
+warmup_pending = set()
+poll_scheduler = PollScheduler()
+metrics.monitored_positions_gauge.callback = lambda: {(): len(monitored_positions)}
+request_budget = RequestBudget(MONITOR_REQUEST_BUDGET)
+
+# Time of the last snapshot sync per (chain, wallet, controller)
+snapshot_synced_at = {}
+
+# Borrow rates by (chain, controller), replaced as a whole on every update.
+# Only these fields are decoded from the market lists.
+BORROW_RATE_FIELDS = ('data', 'controller', 'name', 'borrow_apy')
+BorrowRate = namedtuple('BorrowRate', ['name', 'borrow_apy', 'updated_at'])
+borrow_rates_index = MappingProxyType({})
+
+# Time of the last notification per (user_id, position_key)
+last_notification = {}
+
 class Form(StatesGroup):
     language_choice = State()
     set_wallets = State()
@@ -70,6 +214,17 @@ translations = {
         'no_positions': "No active positions found.",
         'health_alert': "Health of the position {market_name} has fallen below {threshold}.",
         'borrow_apy': "Borrow APY",
+        'pos_page': "Positions {first}-{last} of {total}, most at risk first (page {page}/{pages}):",
+        'refresh': "Refresh",
+        'unavailable': "Stats unavailable, try again later.",
+        'pos_expired': "This list has expired, send /pos again.",
+        'stale': "stale",
+        'stress_command': "Price shock scenarios",
+        'stress_title': "Projected health if the collateral price moves (estimate):",
+        'soft_liquidation_price': "Soft liquidation below",
+        'liquidation_price': "Liquidation below",
+        'stress_report_title': "Stress test of {count} monitored positions, {debt} crvUSD debt:",
+        'stress_report_row': "{shock}: {soft} in soft liquidation, {liquidated} liquidatable ({debt} crvUSD)",
     },
     'ru': {
         'start': "Привет! Я бот для мониторинга позиций Curve Lend.\nВот что я могу делать:",
@@ -94,6 +249,17 @@ translations = {
         'no_positions': "Активные позиции не найдены.",
         'health_alert': "Health позиции {market_name} упал ниже {threshold}.",
         'borrow_apy': "APY займа",
+        'pos_page': "Позиции {first}-{last} из {total}, сначала самые рискованные (страница {page}/{pages}):",
+        'refresh': "Обновить",
+        'unavailable': "Данные недоступны, попробуйте позже.",
+        'pos_expired': "Этот список устарел, отправьте /pos снова.",
+        'stale': "устарело",
+        'stress_command': "Сценарии падения цены",
+        'stress_title': "Ожидаемый health при изменении цены залога (оценка):",
+        'soft_liquidation_price': "Soft liquidation ниже",
+        'liquidation_price': "Ликвидация ниже",
+        'stress_report_title': "Стресс-тест {count} позиций под мониторингом, долг {debt} crvUSD:",
+        'stress_report_row': "{shock}: {soft} в soft liquidation, {liquidated} под ликвидацией ({debt} crvUSD)",
     }
 }
 
@@ -101,7 +267,8 @@ async def set_bot_commands(lang):
     commands = [
         BotCommand(command="/set", description=translations[lang]['set_command']),
         BotCommand(command="/pos", description=translations[lang]['pos_command']),
-        BotCommand(command="/monitor", description=translations[lang]['monitor_command'])
+        BotCommand(command="/monitor", description=translations[lang]['monitor_command']),
+        BotCommand(command="/stress", description=translations[lang]['stress_command'])
     ]
     await bot.set_my_commands(commands)
 
@@ -122,7 +289,7 @@ async def process_callback_language(callback_query: types.CallbackQuery):
         user_data[user_id] = {}
     
     user_data[user_id]['language'] = lang
-    save_user_data()
+    await save_user_data(user_id)
 
     await set_bot_commands(lang)
     await callback_query.message.answer(translations[lang]['start'] + f"\n/set — {translations[lang]['set_command']}\n/pos — {translations[lang]['pos_command']}\n/monitor — {translations[lang]['monitor_command']}")
@@ -130,105 +297,214 @@ async def process_callback_language(callback_query: types.CallbackQuery):
 
 # Fetch borrow rates
     
-async def fetch_borrow_rates(session, chain):
-    url = f"https://prices.curve.fi/v1/lending/markets/{chain}?fetch_on_chain=false"
-    async with session.get(url) as response:
-        if response.status == 200:
-            data = await response.json()
-            return chain, data
-        else:
-            logger.error(f"Failed to fetch data for {chain}: {response.status}")
+async def fetch_borrow_rates(chain):
+    """(chain, [(controller, name, borrow_apy)]) of the chain's markets; None instead of the list on failure."""
+    try:
+        data = await curve_client.get_json(f"/v1/lending/markets/{chain}?fetch_on_chain=false", endpoint='markets',
+                                           fields=BORROW_RATE_FIELDS)
+        if data is None:
+            logger.error(f"Failed to fetch data for {chain}")
             return chain, None
+        return chain, [(intern_text(market['controller']), intern_text(market['name']), market['borrow_apy'])
+                       for market in data['data']]
+    except Exception as e:
+        logger.error(f"Failed to read borrow rates for {chain}: {e!r}")
+        return chain, None
 
-async def update_borrow_rates():
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_borrow_rates(session, chain) for chain in SUPPORTED_CHAINS]
-        results = await asyncio.gather(*tasks)
+def build_borrow_rates_index(borrow_rates):
+    """Turn the {chain: {controller: rate}} file layout into a flat (chain, controller) index."""
+    return MappingProxyType({
+        intern_key(chain, controller): BorrowRate(intern_text(rate['name']), rate['borrow_apy'], rate.get('updated_at', 0.0))
+        for chain, markets in borrow_rates.items()
+        for controller, rate in markets.items()
+    })
 
+def save_borrow_rates(index):
     borrow_rates = {}
-    for chain, data in results:
-        if data:
-            borrow_rates[chain] = {
-                market['controller']: {
-                    'name': market['name'],
-                    'borrow_apy': market['borrow_apy']
-                }
-                for market in data['data']
-            }
-
-    with open(BORROW_RATES_FILE, 'w') as f:
-        json.dump(borrow_rates, f)
-
-    logger.info("Borrow rates updated and saved to file.")
+    for (chain, controller), rate in index.items():
+        borrow_rates.setdefault(chain, {})[controller] = rate._asdict()
 
-async def borrow_rate_updater():
-    while True:
-        await update_borrow_rates()
-        await asyncio.sleep(900)  # Sleep for 15 minutes
+    tmp_file = BORROW_RATES_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(borrow_rates, f)
+    os.replace(tmp_file, BORROW_RATES_FILE)
 
-def get_borrow_apy(chain, controller):
+def load_borrow_rates():
+    global borrow_rates_index
     try:
         with open(BORROW_RATES_FILE, 'r') as f:
             borrow_rates = json.load(f)
-        return borrow_rates.get(chain, {}).get(controller, {}).get('borrow_apy', 'N/A')
-    except (FileNotFoundError, json.JSONDecodeError):
+        # Files written before rates carried their own age get the file time instead
+        file_time = os.path.getmtime(BORROW_RATES_FILE)
+        for markets in borrow_rates.values():
+            for rate in markets.values():
+                rate.setdefault('updated_at', file_time)
+        borrow_rates_index = build_borrow_rates_index(borrow_rates)
+        logger.info(f"Loaded {len(borrow_rates_index)} borrow rates from file.")
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, AttributeError):
         logger.error("Failed to read borrow rates file.")
-        return 'N/A'
-        
-# Fetch snapshots        
 
-async def get_position_snapshots(chain, wallet, controller):
-    url = f"https://prices.curve.fi/v1/lending/users/{chain}/{wallet}/{controller}/snapshots"
-    logger.info(f"Sending request to {url}")
+async def update_borrow_rates():
+    global borrow_rates_index
+    tasks = [fetch_borrow_rates(chain) for chain in SUPPORTED_CHAINS]
+    results = await asyncio.gather(*tasks)
+
+    now = time.time()
+    failed_chains = {chain for chain, markets in results if not markets}
+    # Keep the previous rates of chains that failed to update, with their original age
+    borrow_rates = {key: rate for key, rate in borrow_rates_index.items() if key[0] in failed_chains}
+    for chain, markets in results:
+        for controller, name, borrow_apy in markets or ():
+            borrow_rates[(chain, controller)] = BorrowRate(name, borrow_apy, now)
+
+    borrow_rates_index = MappingProxyType(borrow_rates)
+    if failed_chains:
+        logger.warning(f"Borrow rates for {', '.join(sorted(failed_chains))} were not updated and may be stale.")
 
+    # The file is only used for warm restarts, so write it off the event loop
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                logger.info(f"Response from API: status {response.status}")
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Received snapshots data: {data}")
-                    return data
-                else:
-                    logger.error(f"Error getting snapshots data: {response.status}")
-                    return None
-    except Exception as e:
-        logger.error(f"Error when requesting snapshots API: {e}")
-        return None
+        await asyncio.to_thread(save_borrow_rates, borrow_rates_index)
+        logger.info("Borrow rates updated and saved to file.")
+    except OSError as e:
+        logger.error(f"Failed to save borrow rates file: {e}")
+    logger.info(f"HTTP pool stats: {curve_client.pool_stats()}")
+    logger.info(f"Curve API cache stats: {curve_client.cache_stats()}")
+
+async def borrow_rate_updater():
+    while True:
+        try:
+            await update_borrow_rates()
+        except Exception as e:
+            logger.error(f"Failed to update borrow rates: {e!r}")
+        await asyncio.sleep(BORROW_RATES_INTERVAL)
+
+def borrow_rates_rows():
+    """The borrow rate index as plain rows, for passing it to other processes."""
+    return [[chain, controller, rate.name, rate.borrow_apy, rate.updated_at]
+            for (chain, controller), rate in borrow_rates_index.items()]
+
+def apply_borrow_rates(rows):
+    global borrow_rates_index
+    borrow_rates_index = MappingProxyType({
+        intern_key(chain, controller): BorrowRate(intern_text(name), borrow_apy, updated_at)
+        for chain, controller, name, borrow_apy, updated_at in rows
+    })
+
+def get_borrow_apy(chain, controller):
+    rate = borrow_rates_index.get((chain, controller))
+    return rate.borrow_apy if rate else 'N/A'
+
+def get_borrow_rate_age(chain, controller):
+    """Seconds since the borrow rate was last updated, or None if it is unknown."""
+    rate = borrow_rates_index.get((chain, controller))
+    return time.time() - rate.updated_at if rate else None
+
+def format_borrow_apy(lang, chain, controller):
+    borrow_apy = get_borrow_apy(chain, controller)
+    text = f"{round(borrow_apy) if isinstance(borrow_apy, (int, float)) else borrow_apy}%"
+    age = get_borrow_rate_age(chain, controller)
+    if age is not None and age > BORROW_RATES_STALE_AFTER:
+        text += f" ({translations[lang]['stale']} {int(age // 3600)}h)"
+    return text
+
+# Fetch snapshots        
+
+async def get_position_snapshots(chain, wallet, controller, start=None):
+    path = f"/v1/lending/users/{chain}/{wallet}/{controller}/snapshots"
+    if start is not None:
+        path += f"?start={start}"
+    return await curve_client.get_json(path, endpoint='snapshots', fields=SNAPSHOT_FIELDS)
         
 # Function to calculate hours
 def format_time_difference(time_diff):
     total_hours = int(time_diff.total_seconds() // 3600)
     return f"{total_hours}h"
-    
-# Function to calculate health change
-def calculate_health_change(current_health, snapshots):
-    if not snapshots or 'data' not in snapshots or not snapshots['data']:
-        return None, None
 
-    last_snapshot = snapshots['data'][-1]
-    last_snapshot_health = last_snapshot.get('health_full')
-    last_snapshot_timestamp_str = last_snapshot.get('timestamp')
+def parse_snapshot_timestamp(value):
+    """Snapshot timestamps come either as unix time or as an ISO string in UTC, return unix seconds."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        parsed = datetime.fromisoformat(str(value).rstrip('Z'))
+    except ValueError:
+        logger.error(f"Unable to parse timestamp: {value}")
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)  # Not local time, the points recorded here use time.time()
+    return int(parsed.timestamp())
+
+async def sync_position_snapshots(chain, wallet, controller):
+    """Pull snapshots newer than the last one we hold into the health history."""
+    key = (chain, wallet, controller)
+    now = time.time()
+    if now - snapshot_synced_at.get(key, 0) < SNAPSHOT_SYNC_INTERVAL:
+        return
+    snapshot_synced_at[key] = now
 
-    if last_snapshot_health is None or last_snapshot_timestamp_str is None:
-        return None, None
+    synced_until = await health_store.synced_until(key)
+    snapshots = await get_position_snapshots(chain, wallet, controller,
+                                             start=synced_until + 1 if synced_until is not None else None)
+    if not snapshots or not snapshots.get('data'):
+        return
+
+    points = []
+    for snapshot in snapshots['data']:
+        timestamp = parse_snapshot_timestamp(snapshot.get('timestamp'))
+        health = snapshot.get('health_full')
+        if timestamp is None or health is None or (synced_until is not None and timestamp <= synced_until):
+            continue
+        points.append((timestamp, health, snapshot.get('debt'), snapshot.get('oracle_price')))
+    if points:
+        await health_store.add_snapshots(key, points, max(point[0] for point in points))
 
+async def record_position_stats(stats_by_key):
+    """Add the current stats of positions to the health history."""
+    timestamp = int(time.time())
     try:
-        # Попробуем сначала обработать timestamp как число (unix timestamp)
-        last_snapshot_timestamp = datetime.fromtimestamp(float(last_snapshot_timestamp_str))
-    except ValueError:
-        # Если не удалось, попробуем обработать как строку в формате ISO
-        try:
-            last_snapshot_timestamp = datetime.fromisoformat(last_snapshot_timestamp_str.rstrip('Z'))
-        except ValueError:
-            # Если и это не удалось, логируем ошибку и возвращаем None
-            logger.error(f"Unable to parse timestamp: {last_snapshot_timestamp_str}")
-            return None, None
+        await health_store.add_points([
+            key + (timestamp, stats['health_full'], stats.get('debt'), stats.get('oracle_price'))
+            for key, stats in stats_by_key.items() if stats and stats.get('health_full') is not None
+        ])
+    except Exception as e:
+        logger.error(f"Failed to record health history: {e}")
+
+async def get_health_changes(chain, wallet, controller, current_health):
+    """Health change over each of HEALTH_CHANGE_WINDOWS as (change, time_diff) pairs, from local history."""
+    try:
+        await sync_position_snapshots(chain, wallet, controller)
+        now = time.time()
+        points = await health_store.points_before((chain, wallet, controller),
+                                                  [int(now - window) for window in HEALTH_CHANGE_WINDOWS])
+    except Exception as e:
+        logger.error(f"Failed to read health history: {e}")
+        return []
+
+    changes = []
+    seen = set()
+    for point in points:
+        if point is None or point[0] in seen:
+            continue
+        seen.add(point[0])
+        timestamp, health = point
+        changes.append((round(current_health - health, 2), timedelta(seconds=now - timestamp)))
+    return changes
 
-    health_change = current_health - last_snapshot_health
-    time_difference = datetime.now() - last_snapshot_timestamp
+def format_health_changes(health_changes):
+    if not health_changes:
+        return ""
+    return " (" + ", ".join(f"{change:+.2f} / {format_time_difference(time_diff)}"
+                            for change, time_diff in health_changes) + ")"
 
-    return round(health_change, 2), time_difference
+async def health_history_pruner():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            removed = await health_store.prune(int(time.time() - HEALTH_HISTORY_RETENTION))
+            logger.info(f"Pruned {removed} old health history points.")
+        except Exception as e:
+            logger.error(f"Failed to prune health history: {e}")
 
 # Settings /set
 @dp.message(Command("set"))
@@ -248,50 +524,102 @@ async def process_wallets(message: types.Message, state: FSMContext):
         user_data[user_id] = {}
     
     user_data[user_id]['wallets'] = wallets
-    save_user_data()
+    await save_user_data(user_id)
+    await user_settings_changed(user_id, wallets_changed=True)
 
     await message.answer(translations[lang]['wallets_saved'])
     await state.clear()
 
 # Function to get positions
+# Only these fields are decoded from wallet lookups
+POSITIONS_FIELDS = ('markets', 'controller', 'market_name')
+
+def positions_path(chain, wallet):
+    return f"/v1/lending/users/{chain}/{wallet}"
+
 async def get_positions(chain, wallet):
-    url = f"https://prices.curve.fi/v1/lending/users/{chain}/{wallet}"
-    logger.info(f"Sending request to {url}")
-    
+    return await curve_client.get_json(positions_path(chain, wallet), endpoint='positions', limit=api_limits.get(chain),
+                                       fields=POSITIONS_FIELDS)
+
+# Market index
+async def load_market_index():
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                logger.info(f"Response from API: status {response.status}")
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Received data: {data}")
-                    return data
-                else:
-                    logger.error(f"Error getting data: {response.status}")
-                    return None
+        market_index.update(await market_index_store.load())
     except Exception as e:
-        logger.error(f"Error when requesting API: {e}")
+        logger.error(f"Failed to load the market index: {e}")
+    logger.info(f"Loaded the markets of {len(market_index)} wallets from the market index.")
+
+async def lookup_wallet_markets(chain, wallet, refresh=False):
+    """Look up the markets of a wallet in the Curve API and store them in the market index."""
+    if refresh:
+        curve_client.cache.invalidate(positions_path(chain, wallet))
+    positions = await get_positions(chain, wallet)
+    if positions is None:
         return None
+    markets = intern_markets({market['controller']: market.get('market_name') for market in positions.get('markets') or []})
+    looked_up_at = time.time()
+    market_index[intern_key(chain, wallet)] = (looked_up_at, markets)
+    if market_index_forwarder is not None:
+        market_index_forwarder(chain, wallet, looked_up_at, markets)
+    try:
+        await market_index_store.save_wallet(chain, wallet, markets, looked_up_at)
+    except Exception as e:
+        logger.error(f"Failed to save the markets of {chain} wallet {wallet}: {e}")
+    return markets
 
-# Function to get position statistics
-async def get_position_stats(chain, wallet, controller):
-    url = f"https://prices.curve.fi/v1/lending/users/{chain}/{wallet}/{controller}/stats"
-    logger.info(f"Sending request to {url}")
+async def wallet_markets(chain, wallet, refresh=False, budget=None):
+    """Markets ({controller: market_name}) of a wallet, from the market index unless missing, old or refreshed.
+
+    Lookups wait for budget if one is given. If a lookup fails the indexed markets are
+    returned; None if the wallet was never looked up successfully.
+    """
+    entry = market_index.get((chain, wallet))
+    if entry is not None and not refresh and time.time() - entry[0] < MARKET_INDEX_MAX_AGE:
+        return entry[1]
+    if budget is not None:
+        await budget.acquire()
+    markets = await lookup_wallet_markets(chain, wallet, refresh)
+    if markets is None and entry is not None:
+        return entry[1]
+    return markets
+
+async def refresh_wallet_markets(wallets):
+    """Look up the markets of wallets again, returning [chain, wallet, looked_up_at, markets] rows of the successful ones."""
+    wallets = {wallet.strip().lower() for wallet in wallets if wallet.strip()}
+    keys = [(chain, wallet) for wallet in wallets for chain in SUPPORTED_CHAINS]
+    results = await asyncio.gather(*(lookup_wallet_markets(chain, wallet, refresh=True) for chain, wallet in keys))
+    return [[chain, wallet, market_index[(chain, wallet)][0], markets]
+            for (chain, wallet), markets in zip(keys, results) if markets is not None]
 
+def apply_wallet_markets(rows):
+    """Put markets another process looked up into the market index; that process has saved them already."""
+    for chain, wallet, looked_up_at, markets in rows:
+        market_index[intern_key(chain, wallet)] = (looked_up_at, intern_markets(markets))
+
+async def refresh_shard_user(user_id):
+    """Look up a user's changed wallets and send the user to the shard workers with the markets found."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                logger.info(f"Response from API: status {response.status}")
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Received data: {data}")
-                    return data
-                else:
-                    logger.error(f"Error getting data: {response.status}")
-                    return None
+        markets = await refresh_wallet_markets(user_data.get(user_id, {}).get('wallets', []))
     except Exception as e:
-        logger.error(f"Error when requesting API: {e}")
-        return None
+        logger.error(f"Failed to look up the wallets of user {user_id}: {e}")
+        markets = []
+    await shard_coordinator.user_changed(user_id, markets=markets)
+
+async def forget_closed_position(key):
+    """Drop a position without debt from the market index until its wallet is looked up again."""
+    chain, wallet, controller = key
+    entry = market_index.get((chain, wallet))
+    if entry is None or controller not in entry[1]:
+        return
+    del entry[1][controller]
+    try:
+        await market_index_store.remove_market(chain, wallet, controller)
+    except Exception as e:
+        logger.error(f"Failed to remove closed position {key} from the market index: {e}")
+
+# Function to get position statistics
+async def get_position_stats(chain, wallet, controller):
+    return await position_source.get_position_stats(chain, wallet, controller)
         
 # Color the output        
 def get_health_indicator(health):
@@ -307,6 +635,169 @@ def get_health_indicator(health):
 def get_soft_liquidation_indicator(soft_liquidation):
     return "\U0001F7E0" if soft_liquidation else "\U0001F7E2"  # Orange circle if True, otherwise green
 
+# Run a coroutine under a concurrency limit
+async def run_limited(semaphore, coro):
+    async with semaphore:
+        return await coro
+
+def format_position(lang, chain, market_name, stats, health_changes, borrow_apy):
+    health_indicator = get_health_indicator(stats['health_full'])
+    soft_liquidation_indicator = get_soft_liquidation_indicator(stats.get('soft_liquidation', False))
+
+    health_change_str = format_health_changes(health_changes)
+
+    return (
+        f"{translations[lang]['network']}: {chain}\n"
+        f"{translations[lang]['position']}: {market_name}\n"
+        f"{translations[lang]['soft_liquidation']}: {soft_liquidation_indicator} {stats.get('soft_liquidation', False)}\n"
+        f"{translations[lang]['health']}: {health_indicator} {round(stats['health_full'], 2)}%{health_change_str}\n"
+        f"{translations[lang]['debt']}: {round(stats['debt'], 2)} crvUSD\n"
+        f"{translations[lang]['oracle_price']}: {round(stats['oracle_price'], 2)}\n"
+        f"{translations[lang]['borrow_apy']}: {borrow_apy}\n\n"
+    )
+
+async def fetch_position_entry(semaphore, lang, chain, wallet, controller, market_name):
+    """Rendered entry of a position, None if it is not open; stats read within POS_STATS_MAX_AGE are reused."""
+    stats = position_source.cached_stats(chain, wallet, controller, POS_STATS_MAX_AGE)
+    if stats is None:
+        stats = await run_limited(semaphore, get_position_stats(chain, wallet, controller))
+        if stats is None:
+            return (f"{translations[lang]['network']}: {chain}\n"
+                    f"{translations[lang]['position']}: {market_name}\n"
+                    f"⚠️ {translations[lang]['unavailable']}\n\n")
+        if stats["debt"] > 0:
+            await record_position_stats({(chain, wallet, controller): stats})
+    if stats["debt"] == 0:
+        await forget_closed_position((chain, wallet, controller))
+    if stats["health_full"] <= 0 or stats["debt"] <= 0:
+        return None
+    health_changes = await run_limited(semaphore, get_health_changes(chain, wallet, controller, stats['health_full']))
+    borrow_apy = format_borrow_apy(lang, chain, controller)
+    return format_position(lang, chain, market_name, stats, health_changes, borrow_apy)
+
+async def user_position_keys(user_id):
+    """(chain, wallet, controller, market_name) of every indexed market of a user's wallets."""
+    semaphore = asyncio.Semaphore(POS_CONCURRENCY)
+    wallets = list(dict.fromkeys(wallet.strip().lower() for wallet in user_data[user_id]['wallets'] if wallet.strip()))
+    lookups = [(chain, wallet) for wallet in wallets for chain in SUPPORTED_CHAINS]
+    results = await asyncio.gather(*(run_limited(semaphore, wallet_markets(chain, wallet)) for chain, wallet in lookups))
+    return [(chain, wallet, controller, market_name)
+            for (chain, wallet), markets in zip(lookups, results)
+            for controller, market_name in (markets or {}).items()]
+
+async def rank_positions(positions):
+    """Sort positions most at risk first by their last known health, without any upstream request.
+
+    Health comes from cached stats of any age, then from the health history;
+    positions never seen yet sort first, as nothing says they are safe.
+    """
+    health = {}
+    for chain, wallet, controller, _ in positions:
+        stats = position_source.cached_stats(chain, wallet, controller, float('inf'))
+        if stats:
+            health[(chain, wallet, controller)] = stats['health_full']
+    missing = [position[:3] for position in positions if position[:3] not in health]
+    if missing:
+        try:
+            latest = await health_store.latest(missing)
+        except Exception as e:
+            logger.error(f"Failed to load the latest health of {len(missing)} positions: {e}")
+            latest = {}
+        health.update((key, point[1]) for key, point in latest.items())
+    return sorted(positions, key=lambda position: health.get(position[:3], float('-inf')))
+
+async def open_pos_session(user_id):
+    """Rank the user's positions into a new listing, replacing the previous one, whose buttons then expire."""
+    positions = await rank_positions(await user_position_keys(user_id))
+    now = time.monotonic()
+    while pos_sessions and (len(pos_sessions) >= POS_MAX_SESSIONS
+                            or now - next(iter(pos_sessions.values()))['used_at'] > POS_SESSION_TTL):
+        pos_sessions.popitem(last=False)
+    pos_sessions.pop(user_id, None)
+    pos_sessions[user_id] = {'id': f"{random.getrandbits(32):08x}", 'positions': positions, 'page': 0, 'used_at': now,
+                             'lock': asyncio.Lock()}
+    return pos_sessions[user_id]
+
+def find_pos_session(user_id, session_id):
+    """The user's listing if session_id is still its id and it was used within POS_SESSION_TTL, else None."""
+    session = pos_sessions.get(user_id)
+    if session is None or session['id'] != session_id:
+        return None
+    if time.monotonic() - session['used_at'] > POS_SESSION_TTL:
+        del pos_sessions[user_id]
+        return None
+    session['used_at'] = time.monotonic()
+    pos_sessions.move_to_end(user_id)
+    return session
+
+def short_position_key(chain, wallet, controller):
+    """Few characters telling a user's positions apart within callback_data's 64 bytes."""
+    return hashlib.md5(f"{chain}/{wallet}/{controller}".encode()).hexdigest()[:8]
+
+def pos_callback_data(session, action, value):
+    return f"pos_{action}_{session['id']}_{value}"
+
+def pos_page_count(session):
+    return max(1, math.ceil(len(session['positions']) / POS_PAGE_SIZE))
+
+async def render_pos_page(lang, session, page):
+    """Text and keyboard of one page of /pos; only the positions on it are fetched.
+
+    Positions found closed are dropped from the session and the page is filled
+    up from the next ones; the page itself is ordered by the health just read.
+    Renders of one session take turns, as quick taps would otherwise change its
+    positions under each other.
+    """
+    semaphore = asyncio.Semaphore(POS_CONCURRENCY)
+    positions = session['positions']
+    async with session['lock']:
+        while True:
+            page = min(max(page, 0), pos_page_count(session) - 1)
+            start = page * POS_PAGE_SIZE
+            shown = positions[start:start + POS_PAGE_SIZE]
+            entries = await asyncio.gather(*(fetch_position_entry(semaphore, lang, *position) for position in shown))
+            closed = [position for position, entry in zip(shown, entries) if entry is None]
+            if not closed:
+                break
+            for position in closed:
+                positions.remove(position)
+        # Order the page by the health just read
+        entries = dict(zip(shown, entries))
+        shown = positions[start:start + len(shown)] = await rank_positions(shown)
+        entries = [entries[position] for position in shown]
+        session['page'] = page
+    if not positions:
+        return translations[lang]['no_positions'], None
+
+    text = translations[lang]['pos_page'].format(first=start + 1, last=start + len(shown), total=len(positions),
+                                                 page=page + 1, pages=pos_page_count(session)) + "\n\n"
+    for entry in entries:
+        if len(text) + len(entry) > MESSAGE_LIMIT:
+            break
+        text += entry
+
+    buttons = [[InlineKeyboardButton(text=f"\U0001F504 {translations[lang]['refresh']}: {market_name} ({chain})",
+                                     callback_data=pos_callback_data(session, 'refresh',
+                                                                     short_position_key(chain, wallet, controller)))]
+               for chain, wallet, controller, market_name in shown]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀", callback_data=pos_callback_data(session, 'page', page - 1)))
+    if page < pos_page_count(session) - 1:
+        navigation.append(InlineKeyboardButton(text="▶", callback_data=pos_callback_data(session, 'page', page + 1)))
+    if navigation:
+        buttons.append(navigation)
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def edit_message_text(msg, text, reply_markup=None):
+    try:
+        await msg.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if 'message is not modified' not in str(e):
+            logger.error(f"Failed to edit message: {e}")
+    except Exception as e:
+        logger.error(f"Failed to edit message: {e}")
+
 # Request positions /pos
 @dp.message(Command("pos"))
 async def cmd_pos(message: types.Message):
@@ -317,41 +808,108 @@ async def cmd_pos(message: types.Message):
         return
 
     msg = await message.answer("Request sent, please wait...")
+    session = await open_pos_session(user_id)
+    text, keyboard = await render_pos_page(lang, session, 0)
+    await edit_message_text(msg, text, reply_markup=keyboard)
 
-    wallets = user_data[user_id]['wallets']
-    response = ""
-
-    for wallet in wallets:
-        for chain in ['ethereum', 'arbitrum']:
-            positions = await get_positions(chain, wallet)
-            if positions and positions.get("markets"):
-                for market in positions["markets"]:
-                    controller = market["controller"]
-                    stats = await get_position_stats(chain, wallet, controller)
-                    if stats and stats["health_full"] > 0 and stats["debt"] > 0:
-                        snapshots = await get_position_snapshots(chain, wallet, controller)
-                        health_change, time_diff = calculate_health_change(stats['health_full'], snapshots)
-
-                        health_indicator = get_health_indicator(stats['health_full'])
-                        soft_liquidation_indicator = get_soft_liquidation_indicator(stats.get('soft_liquidation', False))
-                        borrow_apy = get_borrow_apy(chain, controller)
-
-                        health_change_str = f" ({health_change:+.2f} / {format_time_difference(time_diff)})" if health_change is not None else ""
-
-                        response += (
-                            f"{translations[lang]['network']}: {chain}\n"
-                            f"{translations[lang]['position']}: {market['market_name']}\n"
-                            f"{translations[lang]['soft_liquidation']}: {soft_liquidation_indicator} {stats.get('soft_liquidation', False)}\n"
-                            f"{translations[lang]['health']}: {health_indicator} {round(stats['health_full'], 2)}%{health_change_str}\n"
-                            f"{translations[lang]['debt']}: {round(stats['debt'], 2)} crvUSD\n"
-                            f"{translations[lang]['oracle_price']}: {round(stats['oracle_price'], 2)}\n"
-                            f"{translations[lang]['borrow_apy']}: {round(borrow_apy) if isinstance(borrow_apy, (int, float)) else borrow_apy}%\n\n"
-                        )
-    
-    if response == "":
-        response = translations[lang]['no_positions']
-    
-    await msg.edit_text(response)
+@dp.callback_query(lambda c: c.data.startswith('pos_'))
+async def process_callback_pos(callback_query: types.CallbackQuery):
+    user_id = str(callback_query.from_user.id)
+    lang = user_data.get(user_id, {}).get('language', 'en')
+    if user_id not in user_data or not user_data[user_id].get('wallets'):
+        await callback_query.answer(translations[lang]['no_wallets'])
+        return
+
+    # Buttons of a replaced, expired or (after a restart) forgotten listing must not act on another one
+    action, _, rest = callback_query.data[len('pos_'):].partition('_')
+    session_id, _, value = rest.partition('_')
+    session = find_pos_session(user_id, session_id)
+    if session is None:
+        await callback_query.answer(translations[lang]['pos_expired'])
+        return
+
+    page = session['page']
+    if action == 'page' and value.isdigit():
+        page = int(value)
+    elif action == 'refresh':
+        for index, (chain, wallet, controller, _) in enumerate(session['positions']):
+            if short_position_key(chain, wallet, controller) == value:
+                position_source.invalidate(chain, wallet, controller)
+                page = index // POS_PAGE_SIZE
+                break
+    await callback_query.answer()
+
+    text, keyboard = await render_pos_page(lang, session, page)
+    await edit_message_text(callback_query.message, text, reply_markup=keyboard)
+
+# Price shock scenarios /stress
+async def collect_user_positions(user_id):
+    """(chain, market_name, stats) of every open position of a user's wallets."""
+    semaphore = asyncio.Semaphore(POS_CONCURRENCY)
+    positions = await user_position_keys(user_id)
+    stats = await asyncio.gather(*(run_limited(semaphore, get_position_stats(chain, wallet, controller))
+                                   for chain, wallet, controller, _ in positions))
+    return [(chain, market_name, position_stats)
+            for (chain, _, _, market_name), position_stats in zip(positions, stats)
+            if position_stats and position_stats['debt'] > 0]
+
+def format_shock(shock):
+    return f"{shock * 100:+.0f}%"
+
+def format_price(price):
+    return "-" if math.isnan(price) else f"{price:.2f}"
+
+def format_stress_position(lang, chain, market_name, stats, result, index):
+    scenarios = "\n".join(
+        f"{format_shock(shock)}: {get_health_indicator(health)} {health:.1f}%"
+        for shock, health in zip(STRESS_SHOCKS, result.health[index])
+    )
+    health_indicator = get_health_indicator(stats['health_full'])
+    return (
+        f"{translations[lang]['network']}: {chain}\n"
+        f"{translations[lang]['position']}: {market_name}\n"
+        f"{translations[lang]['health']}: {health_indicator} {round(stats['health_full'], 2)}%\n"
+        f"{translations[lang]['oracle_price']}: {round(stats['oracle_price'], 2)}\n"
+        f"{translations[lang]['soft_liquidation_price']}: {format_price(result.soft_liquidation_price[index])}\n"
+        f"{translations[lang]['liquidation_price']}: {format_price(result.liquidation_price[index])}\n"
+        f"{scenarios}"
+    )
+
+async def stress_report(lang):
+    """Stress test over the last stats of every monitored position, saved by the monitor (or its workers)."""
+    await flush_monitor_state()
+    _, saved = await monitor_state_store.load()
+    stats_list = [stats for _, _, stats, _ in saved if stats and stats.get('debt', 0) > 0]
+    positions = stress.load_positions(stats_list)
+    soft, liquidated, debt = stress.summarize(positions, stress.stress_test(positions, STRESS_REPORT_SHOCKS))
+    rows = [translations[lang]['stress_report_row'].format(shock=format_shock(shock), soft=soft[i],
+                                                           liquidated=liquidated[i], debt=f"{debt[i]:,.0f}")
+            for i, shock in enumerate(STRESS_REPORT_SHOCKS)]
+    title = translations[lang]['stress_report_title'].format(count=len(stats_list), debt=f"{positions.debt.sum():,.0f}")
+    return "\n".join([title] + rows)
+
+@dp.message(Command("stress"))
+async def cmd_stress(message: types.Message):
+    user_id = str(message.from_user.id)
+    lang = user_data.get(user_id, {}).get('language', 'en')
+    if (message.text or '').split()[1:] == ['all'] and user_id in OPERATOR_IDS:
+        await message.answer(await stress_report(lang))
+        return
+    if user_id not in user_data or not user_data[user_id].get('wallets'):
+        await message.answer(translations[lang]['no_wallets'])
+        return
+
+    found = await collect_user_positions(user_id)
+    if not found:
+        await message.answer(translations[lang]['no_positions'])
+        return
+    result = stress.stress_test(stress.load_positions([stats for _, _, stats in found]), STRESS_SHOCKS)
+    entries = [translations[lang]['stress_title']] + [
+        format_stress_position(lang, chain, market_name, stats, result, index)
+        for index, (chain, market_name, stats) in enumerate(found)
+    ]
+    for text in split_message(entries):
+        await message.answer(text)
 
 # Monitoring /monitor
 @dp.message(Command("monitor"))
@@ -379,7 +937,7 @@ async def process_monitor_threshold(message: types.Message, state: FSMContext):
         return
 
     user_data[user_id]['monitor_threshold'] = threshold
-    save_user_data()
+    await save_user_data(user_id)
 
     await message.answer(translations[lang]['interval_prompt'])
     await state.set_state(Form.monitor_interval)
@@ -397,83 +955,356 @@ async def process_monitor_interval(message: types.Message, state: FSMContext):
 
     user_data[user_id]['notification_interval'] = interval
     user_data[user_id]['monitoring_active'] = True
-    save_user_data()
+    await save_user_data(user_id)
 
     await message.answer(translations[lang]['monitoring_started'])
     await state.clear()
 
-    # Start monitoring in background
-    asyncio.create_task(monitor_positions(user_id))
+    # Check this user's positions right away with the new threshold
+    await user_settings_changed(user_id)
     logger.info(f"Monitoring started for user {user_id}")
 
 # Background monitoring
-async def monitor_positions(user_id):
-    logger.info(f"Monitoring function started for user {user_id}.")
-    last_notification = {}
-    while True:
-        if user_id in user_data and user_data[user_id].get('monitoring_active', False):
-            lang = user_data.get(user_id, {}).get('language', 'en')
-            wallets = user_data[user_id].get('wallets', [])
-            threshold = user_data[user_id].get('monitor_threshold', float('inf'))
-            notification_interval = user_data[user_id].get('notification_interval', 0)  # Interval in hours
-            logger.info(f"Checking positions for user {user_id} with threshold {threshold}.")
-            
-            for wallet in wallets:
-                for chain in SUPPORTED_CHAINS:
-                    positions = await get_positions(chain, wallet)
-                    if positions and positions.get("markets"):
-                        for market in positions["markets"]:
-                            controller = market["controller"]
-                            stats = await get_position_stats(chain, wallet, controller)
-        
-                            if stats and stats["health_full"] < threshold and stats["debt"] > 0:
-                                snapshots = await get_position_snapshots(chain, wallet, controller)
-                                health_change, time_diff = calculate_health_change(stats['health_full'], snapshots)
-        
-                                position_key = f"{chain}_{wallet}_{controller}"
-                                current_time = datetime.now()
-                                if (position_key not in last_notification or 
-                                    (notification_interval > 0 and 
-                                     current_time - last_notification[position_key] >= timedelta(hours=notification_interval))):
-                                    health_indicator = get_health_indicator(stats['health_full'])
-                                    soft_liquidation_indicator = get_soft_liquidation_indicator(stats.get('soft_liquidation', False))
-                                    borrow_apy = get_borrow_apy(chain, controller)
-        
-                                    health_change_str = f" ({health_change:+.2f} / {format_time_difference(time_diff)})" if health_change is not None else ""
-        
-                                    message = (
-                                        f"\u26A0\uFE0F {translations[lang]['health_alert'].format(market_name=market['market_name'], threshold=threshold)}\n\n"
-                                        f"{translations[lang]['soft_liquidation']}: {soft_liquidation_indicator} {stats.get('soft_liquidation', False)}\n"
-                                        f"{translations[lang]['health']}: {health_indicator} {round(stats['health_full'], 2)}%{health_change_str}\n"
-                                        f"{translations[lang]['debt']}: {round(stats['debt'], 2)} crvUSD\n"
-                                        f"{translations[lang]['oracle_price']}: {round(stats['oracle_price'], 2)}\n"                                        
-                                        f"{translations[lang]['borrow_apy']}: {round(borrow_apy) if isinstance(borrow_apy, (int, float)) else borrow_apy}%\n"
-                                    )
-                                    await bot.send_message(user_id, message)
-                                    last_notification[position_key] = current_time
-                                    logger.info(f"Notification sent to user {user_id}")
-            
-            logger.info(f"Next position check for user {user_id} will be in 5 minutes")
+def build_monitor_subscriptions(user_ids=None):
+    """Map each unique (chain, wallet) to the set of users monitoring it."""
+    subscriptions = {}
+    for user_id in (user_ids if user_ids is not None else list(user_data)):
+        data = user_data.get(user_id, {})
+        if not data.get('monitoring_active', False):
+            continue
+        for wallet in data.get('wallets', []):
+            wallet = wallet.strip().lower()
+            if not wallet:
+                continue
+            for chain in SUPPORTED_CHAINS:
+                subscriptions.setdefault(intern_key(chain, wallet), set()).add(user_id)
+    return subscriptions
+
+def format_alert_message(lang, market_name, threshold, chain, controller, stats, health_changes):
+    health_indicator = get_health_indicator(stats['health_full'])
+    soft_liquidation_indicator = get_soft_liquidation_indicator(stats.get('soft_liquidation', False))
+    borrow_apy = format_borrow_apy(lang, chain, controller)
+
+    health_change_str = format_health_changes(health_changes)
+
+    return (
+        f"\u26A0\uFE0F {translations[lang]['health_alert'].format(market_name=market_name, threshold=threshold)}\n\n"
+        f"{translations[lang]['soft_liquidation']}: {soft_liquidation_indicator} {stats.get('soft_liquidation', False)}\n"
+        f"{translations[lang]['health']}: {health_indicator} {round(stats['health_full'], 2)}%{health_change_str}\n"
+        f"{translations[lang]['debt']}: {round(stats['debt'], 2)} crvUSD\n"
+        f"{translations[lang]['oracle_price']}: {round(stats['oracle_price'], 2)}\n"
+        f"{translations[lang]['borrow_apy']}: {borrow_apy}\n"
+    )
+
+def notification_due(user_id, position_key, current_time):
+    notification_interval = user_data[user_id].get('notification_interval', 0)  # Interval in hours
+    last_sent = last_notification.get((user_id, position_key))
+    return (last_sent is None or
+            (notification_interval > 0 and
+             current_time - last_sent >= timedelta(hours=notification_interval)))
+
+async def discover_positions(user_ids=None, refresh=False):
+    """Take the markets of monitored wallets from the market index and schedule new positions for an immediate check.
+
+    Wallets missing from the index or looked up more than MARKET_INDEX_MAX_AGE ago
+    (all of them with refresh) are looked up in the Curve API first. Without
+    user_ids all monitored wallets are updated and positions nobody monitors any
+    more are dropped; with user_ids only those users are added.
+    """
+    global monitor_subscriptions
+    subscriptions = build_monitor_subscriptions(user_ids)
+    if user_ids is None:
+        monitor_subscriptions = subscriptions
+    else:
+        for wallet_key, users in subscriptions.items():
+            monitor_subscriptions.setdefault(wallet_key, set()).update(users)
+
+    semaphore = asyncio.Semaphore(MONITOR_CONCURRENCY)
+    wallet_keys = list(subscriptions)
+    results = await asyncio.gather(*(run_limited(semaphore, wallet_markets(chain, wallet, refresh, request_budget))
+                                     for chain, wallet in wallet_keys))
+    found = {}
+    looked_up = set()
+    for (chain, wallet), markets in zip(wallet_keys, results):
+        if markets is None:
+            continue  # Keep what we knew about this wallet until a lookup succeeds
+        looked_up.add((chain, wallet))
+        for controller, market_name in list(markets.items()):
+            found[intern_key(chain, wallet, controller)] = market_name
+
+    for key in found:
+        if key not in monitored_positions or user_ids is not None:
+            poll_scheduler.schedule(key, 0, 0)
+    monitored_positions.update(found)
+
+    if user_ids is None:
+        for key in list(monitored_positions):
+            wallet_key = key[:2]
+            if wallet_key not in monitor_subscriptions or (wallet_key in looked_up and key not in found):
+                del monitored_positions[key]
+                poll_scheduler.remove(key)
+                health_trend.pop(key, None)
+
+    logger.info(f"Monitoring {len(monitored_positions)} positions "
+                f"for {len({u for users in monitor_subscriptions.values() for u in users})} users "
+                f"({len(wallet_keys)} wallets).")
+
+def position_subscribers(key):
+    """Users with active monitoring subscribed to a position's wallet."""
+    return [user_id for user_id in monitor_subscriptions.get(key[:2], ())
+            if user_data.get(user_id, {}).get('monitoring_active', False)]
+
+def next_poll_interval(key, stats):
+    """Check positions near a user's threshold, falling fast or in soft liquidation more often."""
+    thresholds = [user_data[user_id].get('monitor_threshold', float('inf')) for user_id in position_subscribers(key)]
+    thresholds = [threshold for threshold in thresholds if threshold != float('inf')]
+    if not thresholds:
+        return MAX_POLL_INTERVAL
+    margin = stats['health_full'] - max(thresholds)
+
+    now = time.time()
+    health_rate = None
+    previous = health_trend.get(key)
+    if previous is not None and now > previous[0]:
+        health_rate = (stats['health_full'] - previous[1]) / (now - previous[0]) * 3600
+    health_trend[key] = (now, stats['health_full'])
+
+    return poll_interval(margin, health_rate, stats.get('soft_liquidation', False))
+
+async def check_position_alerts(key, stats):
+    """Notify every subscriber whose threshold the position has fallen below."""
+    chain, wallet, controller = key
+    position_key = f"{chain}_{wallet}_{controller}"
+    current_time = datetime.now()
+    pending = [user_id for user_id in position_subscribers(key)
+               if stats["health_full"] < user_data[user_id].get('monitor_threshold', float('inf'))
+               and notification_due(user_id, position_key, current_time)]
+    if not pending:
+        return
+
+    health_changes = await get_health_changes(chain, wallet, controller, stats['health_full'])
+    for user_id in pending:
+        lang = user_data[user_id].get('language', 'en')
+        threshold = user_data[user_id].get('monitor_threshold', float('inf'))
+        message = format_alert_message(lang, monitored_positions[key], threshold, chain, controller,
+                                       stats, health_changes)
+        notifier.enqueue(user_id, position_key, message)
+        last_notification[(user_id, position_key)] = current_time
+        dirty_notifications[(user_id, position_key)] = current_time.timestamp()
+        logger.info(f"Notification queued for user {user_id}")
+
+async def poll_position(key):
+    interval = ERROR_POLL_INTERVAL
+    start = time.perf_counter()
+    try:
+        stats = await get_position_stats(*key)
+        if stats is None:
+            return
+        warmup_pending.discard(key)
+        if key in monitored_positions:
+            dirty_positions[key] = (monitored_positions[key], stats, time.time())
+        await record_position_stats({key: stats})
+        if stats["debt"] > 0:
+            await check_position_alerts(key, stats)
+            interval = next_poll_interval(key, stats)
         else:
-            logger.info(f"Monitoring for user {user_id} is not active or user not found.")
-        
-        await asyncio.sleep(300)  # Check every 5 minutes
+            # Closed: stop polling until a lookup of the wallet finds the market again
+            monitored_positions.pop(key, None)
+            health_trend.pop(key, None)
+            dirty_positions.pop(key, None)
+            await forget_closed_position(key)
+    except Exception as e:
+        logger.error(f"Failed to check position {key}: {e}")
+    finally:
+        metrics.monitor_poll_duration.observe(value=time.perf_counter() - start)
+        if key in monitored_positions:
+            poll_scheduler.schedule(key, interval, interval)
+
+async def flush_monitor_state():
+    global dirty_notifications, dirty_positions
+    notifications, dirty_notifications = dirty_notifications, {}
+    positions, dirty_positions = dirty_positions, {}
+    if not notifications and not positions:
+        return
+    try:
+        await monitor_state_store.save(
+            [(user_id, position_key, sent_at) for (user_id, position_key), sent_at in notifications.items()],
+            [(key, market_name, stats, updated_at) for key, (market_name, stats, updated_at) in positions.items()],
+        )
+    except Exception as e:
+        logger.error(f"Failed to save monitor state: {e}")
 
-# Function to start monitoring for all users when the bot starts
-async def start_monitoring_for_all_users():
-    logger.info("Starting monitoring for all users at bot startup.")
-    for user_id, data in user_data.items():
-        if data.get('monitoring_active', False):
-            asyncio.create_task(monitor_positions(user_id))
-            logger.info(f"Monitoring started for user {user_id}")
+async def monitor_state_flusher():
+    while True:
+        await asyncio.sleep(STATE_FLUSH_INTERVAL)
+        await flush_monitor_state()
+
+async def restore_monitor_state():
+    """Restore sent notifications and the last stats of positions, and spread their first checks.
+
+    Restored stats are put in the cache as stale entries, so /pos can answer from them
+    while the position source is slow during warm-up. Returns the number of restored positions.
+    """
+    global monitor_subscriptions
+    try:
+        await monitor_state_store.prune(time.time() - STATE_RETENTION)
+        notifications, positions = await monitor_state_store.load()
+    except Exception as e:
+        logger.error(f"Failed to load monitor state: {e}")
+        return 0
+
+    for user_id, position_key, sent_at in notifications:
+        last_notification[(user_id, position_key)] = datetime.fromtimestamp(sent_at)
+
+    monitor_subscriptions = build_monitor_subscriptions()
+    stale_ttl = 2 * STARTUP_SPREAD
+    restored = 0
+    for key, market_name, stats, updated_at in positions:
+        if key[:2] not in monitor_subscriptions:
+            continue
+        if key[:2] in market_index and key[2] not in market_index[key[:2]][1]:
+            continue  # Closed since it was saved
+        monitored_positions[key] = market_name
+        delay = STARTUP_SPREAD
+        if stats:
+            position_source.prime(*key, stats, stale_ttl)
+            if stats.get('debt', 0) > 0:
+                delay = min(delay, next_poll_interval(key, stats))
+        # Jitter keeps restored positions from hitting the position source at the same moment
+        poll_scheduler.schedule(key, random.uniform(0, delay), delay)
+        warmup_pending.add(key)
+        restored += 1
+
+    logger.info(f"Restored {len(notifications)} notifications and {restored} positions from the monitor state.")
+    return restored
+
+async def restore_notifications(user_ids):
+    """Load the notifications sent to users handed over from another shard worker.
+
+    Keeps whichever of the loaded and the known send time is later, so alerts
+    suppressed before the handover stay suppressed.
+    """
+    try:
+        notifications = await monitor_state_store.load_notifications(user_ids)
+    except Exception as e:
+        logger.error(f"Failed to load notifications: {e}")
+        return
+    merge_notifications(notifications)
+
+def merge_notifications(notifications):
+    """Take (user_id, position_key, sent_at) notifications sent elsewhere, keeping the later of two send times."""
+    for user_id, position_key, sent_at in notifications:
+        sent_at = datetime.fromtimestamp(sent_at)
+        if last_notification.get((user_id, position_key), sent_at) <= sent_at:
+            last_notification[(user_id, position_key)] = sent_at
+
+async def report_warmup():
+    """Log how long the restored positions took to be checked and the peak request rate meanwhile."""
+    peak = 0
+    previous = position_source.stats['requests']
+    deadline = time.monotonic() + 2 * STARTUP_SPREAD
+    while warmup_pending and time.monotonic() < deadline:
+        await asyncio.sleep(1)
+        requests = position_source.stats['requests']
+        peak = max(peak, requests - previous)
+        previous = requests
+    time_to_ready = time.monotonic() - STARTED_AT
+    metrics.startup_time_to_ready.set(value=round(time_to_ready, 3))
+    metrics.startup_peak_requests.set(value=peak)
+    logger.info(f"Warm-up finished in {time_to_ready:.1f}s "
+                f"({len(warmup_pending)} positions still unchecked), peak {peak} upstream requests/s.")
+
+async def position_discovery(initial_delay=0):
+    await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            with metrics.monitor_discovery_duration.time():
+                await discover_positions()
+        except Exception as e:
+            logger.error(f"Position discovery failed: {e}")
+        await asyncio.sleep(DISCOVERY_INTERVAL)
+
+async def position_monitor(restored=0):
+    """Poll each position when it is due, the most at-risk ones first, within the request budget.
+
+    After a warm start the first wallet lookups wait for the restored positions to be checked.
+    """
+    logger.info("Position monitor started.")
+    asyncio.create_task(position_discovery(STARTUP_SPREAD if restored else 0))
+    if POSITION_SOURCE == 'rpc':
+        # Checks are batched into a few eth_calls per block, the Curve API budget does not apply
+        semaphore = asyncio.Semaphore(RPC_MONITOR_CONCURRENCY)
+        budget = RequestBudget(RPC_MONITOR_BUDGET)
+    else:
+        semaphore = asyncio.Semaphore(MONITOR_CONCURRENCY)
+        budget = request_budget
+    while True:
+        if not poll_scheduler.has_ready():
+            delay = poll_scheduler.time_until_next()
+            await poll_scheduler.wait(delay if delay is not None else DISCOVERY_INTERVAL)
+            continue
+
+        await semaphore.acquire()
+        await budget.acquire()
+        popped = poll_scheduler.pop_ready()
+        if popped is None:
+            semaphore.release()
+            continue
+        key, due = popped
+        metrics.monitor_poll_lag.observe(value=max(0.0, time.monotonic() - due))
+        task = asyncio.create_task(poll_position(key))
+        task.add_done_callback(lambda _: semaphore.release())
 
 # Bot launch
+async def start_sharded_monitoring():
+    global shard_coordinator
+    shard_coordinator = sharding.ShardCoordinator(user_data, notifier.enqueue, apply_borrow_rates,
+                                                  on_markets=apply_wallet_markets, port=SHARD_PORT)
+    await shard_coordinator.start()
+    return await sharding.spawn_workers(SHARD_WORKERS, port=SHARD_PORT)
+
 async def main():
-    await set_bot_commands('en')  # Set bot commands (default to English)
-    await start_monitoring_for_all_users()  # Start monitoring for all users
-    asyncio.create_task(borrow_rate_updater())  # Start borrow rate updater
-    logger.info("Bot is launched and ready to work.")
-    await dp.start_polling(bot)
+    await asyncio.to_thread(open_user_store)  # Migrate and load user settings
+    await health_store.open()  # Open the local health history
+    await monitor_state_store.open()  # Open the state kept across restarts
+    await market_index_store.open()
+    await load_market_index()  # Markets of known wallets, looked up again only every MARKET_INDEX_MAX_AGE
+    await curve_client.start()  # Open the shared Curve API connection pool
+    await position_source.start()
+    if METRICS_PORT:
+        try:
+            await metrics.start_metrics_server(port=METRICS_PORT)  # Prometheus metrics for local scraping
+        except OSError as e:
+            logger.error(f"Failed to start metrics server: {e}")
+    await asyncio.to_thread(load_borrow_rates)  # Warm start from the last saved borrow rates
+    workers = []
+    try:
+        await set_bot_commands('en')  # Set bot commands (default to English)
+        notifier.start()  # Deliver alerts independently of monitoring
+        if SHARD_WORKERS > 0:
+            workers = await start_sharded_monitoring()  # Workers monitor positions and update borrow rates
+        else:
+            restored = await restore_monitor_state()  # Notifications and last stats from before the restart
+            asyncio.create_task(position_monitor(restored))  # Start monitoring for all users
+            asyncio.create_task(monitor_state_flusher())  # Save monitor state for the next restart
+            asyncio.create_task(borrow_rate_updater())  # Start borrow rate updater
+            if restored:
+                asyncio.create_task(report_warmup())
+        asyncio.create_task(health_history_pruner())  # Drop health history older than the largest window
+        logger.info(f"Bot is launched and ready to work ({time.monotonic() - STARTED_AT:.1f}s after start).")
+        await dp.start_polling(bot)
+    finally:
+        await sharding.stop_workers(workers)  # Workers save their monitor state before exiting
+        if shard_coordinator is not None:
+            await shard_coordinator.stop()
+        await notifier.stop()
+        await flush_monitor_state()
+        await position_source.close()
+        await curve_client.close()
+        monitor_state_store.close()
+        market_index_store.close()
+        user_store.close()
+        health_store.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cache settings
+CACHE_MAX_ENTRIES = 10000    # LRU bound on cached responses
+REVALIDATE_TIMEOUT = 2.0     # Seconds to wait for a refresh before serving stale data
+
+
+class ResponseCache:
+    """TTL + LRU cache for API responses with single-flight request coalescing.
+
+    A fresh entry is returned directly. Concurrent requests for the same key
+    share one in-flight fetch. An expired entry that is still within its stale
+    window is refreshed, but if the refresh takes longer than
+    REVALIDATE_TIMEOUT (or fails) the stale value is served instead. Failed
+    fetches (None) are never cached.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, revalidate_timeout=REVALIDATE_TIMEOUT):
+        self.max_entries = max_entries
+        self.revalidate_timeout = revalidate_timeout
+        self.entries = OrderedDict()  # key -> (value, expires_at, stale_until, stored_at)
+        self.in_flight = {}           # key -> asyncio.Task
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'stale': 0,
+            'errors': 0,
+            'evictions': 0,
+            'peeks': 0,  # Values read by peek(), kept out of the hit rate as they never fetch
+        }
+
+    def _store(self, key, value, ttl, stale_ttl, stored_at=None):
+        now = time.monotonic()
+        self.entries[key] = (value, now + ttl, now + ttl + stale_ttl, now if stored_at is None else stored_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _start_fetch(self, key, fetch, ttl, stale_ttl):
+        async def run():
+            try:
+                value = await fetch()
+                if value is not None:
+                    self._store(key, value, ttl, stale_ttl)
+                else:
+                    self.stats['errors'] += 1
+                return value
+            finally:
+                self.in_flight.pop(key, None)
+
+        task = asyncio.create_task(run())
+        self.in_flight[key] = task
+        return task
+
+    async def get(self, key, fetch, ttl, stale_ttl=0):
+        """Return the cached value for key, calling fetch() to (re)load it when needed."""
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and now < entry[1]:
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+        stale = entry[0] if entry is not None and now < entry[2] else None
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            self.stats['misses'] += 1
+            task = self._start_fetch(key, fetch, ttl, stale_ttl)
+
+        if stale is None:
+            return await asyncio.shield(task)
+
+        # Serve stale data if the upstream is slow or failing, the refresh keeps running
+        try:
+            value = await asyncio.wait_for(asyncio.shield(task), self.revalidate_timeout)
+        except asyncio.TimeoutError:
+            value = None
+        if value is None:
+            self.stats['stale'] += 1
+            return stale
+        return value
+
+    def prime(self, key, value, stale_ttl):
+        """Store an already expired value, served only while a refresh is slow or failing."""
+        if key not in self.entries:
+            self._store(key, value, 0, stale_ttl, stored_at=float('-inf'))
+
+    def peek(self, key, max_age):
+        """The value stored for key within the last max_age seconds, without fetching; None otherwise."""
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[3] > max_age:
+            return None
+        self.stats['peeks'] += 1
+        return entry[0]
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def cache_stats(self):
+        stats = dict(self.stats)
+        stats['entries'] = len(self.entries)
+        stats['in_flight'] = len(self.in_flight)
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round((stats['hits'] + stats['coalesced']) / lookups, 3) if lookups else 0.0
+        return stats
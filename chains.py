@@ -0,0 +1,59 @@
+"""Registry of the chains the bot follows.
+
+The defaults below can be overridden with a JSON file (CHAINS_FILE, default
+chains.json in the working directory) mapping chain names to settings, e.g.
+
+    {"ethereum": {"concurrency": 10}, "arbitrum": {"concurrency": 20, "rpc_url": "https://..."},
+     "fraxtal": {"concurrency": 5, "block_time": 2, "rpc_url": "https://rpc.frax.com"}}
+
+Listed chains replace the defaults, unset fields fall back to the default of
+the chain (or of DEFAULT_CHAIN for a new chain).
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CHAINS_FILE = os.environ.get('CHAINS_FILE', 'chains.json')
+
+# concurrency: simultaneous requests for the chain to one upstream (Curve API or JSON-RPC node)
+# block_time: seconds between blocks, stats read from a node are reused for that long
+# rpc_url: JSON-RPC endpoint, used by the 'rpc' position source
+Chain = namedtuple('Chain', ['name', 'concurrency', 'block_time', 'rpc_url'])
+
+DEFAULT_CHAIN = Chain(name=None, concurrency=10, block_time=2, rpc_url=None)
+
+DEFAULT_CHAINS = {
+    'ethereum': Chain('ethereum', concurrency=15, block_time=12, rpc_url='https://ethereum-rpc.publicnode.com'),
+    'arbitrum': Chain('arbitrum', concurrency=15, block_time=1, rpc_url='https://arbitrum-one-rpc.publicnode.com'),
+}
+
+
+def load_chains(path=CHAINS_FILE):
+    """Chains by name, from path if it exists, otherwise DEFAULT_CHAINS."""
+    if not os.path.exists(path):
+        return dict(DEFAULT_CHAINS)
+    try:
+        with open(path, 'r') as file:
+            config = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to load chains from {path}, using the defaults: {e}")
+        return dict(DEFAULT_CHAINS)
+
+    chains = {}
+    for name, settings in config.items():
+        default = DEFAULT_CHAINS.get(name, DEFAULT_CHAIN)
+        try:
+            chains[name] = default._replace(name=name, **(settings or {}))
+        except (TypeError, ValueError) as e:
+            logger.error(f"Invalid settings for chain {name}: {e}")
+    logger.info(f"Loaded chains {', '.join(chains)} from {path}")
+    return chains
+
+
+def chain_limits(chains):
+    """One semaphore per chain holding its concurrency limit."""
+    return {name: asyncio.Semaphore(chain.concurrency) for name, chain in chains.items()}
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextlib import nullcontext
+
+import aiohttp
+
+import metrics
+from cache import ResponseCache
+from records import extract_json
+from resilience import CircuitBreaker, RetryBudget, UpstreamError, backoff_delay, hedged
+
+logger = logging.getLogger(__name__)
+
+# Curve API
+CURVE_API_URL = os.environ.get('CURVE_API_URL', 'https://prices.curve.fi')
+
+# Connection pool settings
+POOL_LIMIT = 100            # Total simultaneous connections
+POOL_LIMIT_PER_HOST = 30    # Simultaneous connections to one host
+KEEPALIVE_TIMEOUT = 60      # Seconds an idle connection is kept open
+DNS_CACHE_TTL = 300         # Seconds a DNS lookup is cached
+
+# Request timeouts (seconds)
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+
+# Per endpoint: (deadline, hedge_delay) in seconds. The deadline covers all attempts of a call
+# including backoff; a call still waiting after hedge_delay is raced against a duplicate request
+# (None: never hedged, the market list is large and fetched rarely).
+REQUEST_POLICIES = {
+    'stats': (10, 1.0),
+    'positions': (15, 2.0),
+    'snapshots': (20, 3.0),
+    'markets': (30, None),
+}
+DEFAULT_REQUEST_POLICY = (20, None)
+
+# Fraction of responses whose body is logged at DEBUG level (0 disables payload logging)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('CURVE_PAYLOAD_LOG_SAMPLE_RATE', '0'))
+
+# Cache lifetimes per endpoint: (ttl, stale_ttl) in seconds.
+# Stats change with every block, the market list and snapshot history change slowly.
+CACHE_TTLS = {
+    'stats': (5, 120),
+    'positions': (120, 900),
+    'snapshots': (600, 3600),
+    'markets': (300, 1800),
+}
+
+
+class CurveClient:
+    """Long-lived HTTP client shared by all Curve API calls.
+
+    Keeps one aiohttp session with a keep-alive connection pool, so repeated
+    requests to prices.curve.fi reuse open connections instead of doing a new
+    DNS lookup and TLS handshake each time. Every request goes through the
+    guards of resilience.py: a deadline and hedge delay from REQUEST_POLICIES,
+    retries of transient errors under one shared RetryBudget and a
+    CircuitBreaker per endpoint.
+    """
+
+    def __init__(self, base_url=CURVE_API_URL, limit=POOL_LIMIT, limit_per_host=POOL_LIMIT_PER_HOST,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 policies=REQUEST_POLICIES):
+        self.base_url = base_url
+        self.policies = policies
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout,
+                                             sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+        self.cache = ResponseCache()
+        self.retry_budget = RetryBudget()
+        self.breakers = {}  # endpoint -> CircuitBreaker
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'hedges': 0,
+            'shed': 0,
+            'deadline_exceeded': 0,
+            'in_flight': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+        }
+
+    async def start(self):
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=DNS_CACHE_TTL,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                             trace_configs=[trace_config])
+        logger.info(f"HTTP client started (pool limit {self.limit}, per host {self.limit_per_host})")
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info(f"HTTP client closed. Pool stats: {self.pool_stats()}")
+        self.session = None
+
+    async def _on_connection_create(self, session, ctx, params):
+        self.stats['connections_created'] += 1
+
+    async def _on_connection_reuse(self, session, ctx, params):
+        self.stats['connections_reused'] += 1
+
+    def pool_stats(self):
+        stats = dict(self.stats)
+        acquired = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_rate'] = round(stats['connections_reused'] / acquired, 3) if acquired else 0.0
+        return stats
+
+    def cache_stats(self):
+        return self.cache.cache_stats()
+
+    def breaker_states(self):
+        return {endpoint: breaker.state for endpoint, breaker in self.breakers.items()}
+
+    async def get_json(self, path, endpoint=None, limit=None, fields=None, record=None):
+        """GET a Curve API path and return the decoded JSON, or None on any error.
+
+        If endpoint names an entry of CACHE_TTLS, the response is served through the cache.
+        A request that reaches the API waits for limit (a semaphore) if one is given.
+        With fields only those keys are decoded (see records.extract_json); record, if
+        given, turns the decoded JSON into the value returned and cached.
+        """
+        fetch = lambda: self.fetch_json(path, endpoint, limit, fields, record)  # noqa: E731
+        if endpoint in CACHE_TTLS:
+            ttl, stale_ttl = CACHE_TTLS[endpoint]
+            return await self.cache.get(path, fetch, ttl, stale_ttl)
+        return await fetch()
+
+    def _spend_retry(self, endpoint, kind):
+        """Take a token of the retry budget for one of kind ('retries' or 'hedges'), False if there is none left."""
+        if not self.retry_budget.try_withdraw():
+            return False
+        self.stats[kind] += 1
+        metrics.curve_resilience_events.inc(endpoint, kind)
+        return True
+
+    async def fetch_json(self, path, endpoint=None, limit=None, fields=None, record=None):
+        endpoint = endpoint or 'other'
+        breaker = self.breakers.setdefault(endpoint, CircuitBreaker())
+        if not breaker.allow():
+            self.stats['shed'] += 1
+            metrics.curve_resilience_events.inc(endpoint, 'shed')
+            return None
+
+        url = path if path.startswith('http') else f"{self.base_url}{path}"
+        deadline, hedge_delay = self.policies.get(endpoint, DEFAULT_REQUEST_POLICY)
+        self.retry_budget.deposit()
+        retries = 0
+        # The deadline starts once the first attempt has its slot of limit: waiting in the
+        # bot's own queue says nothing about the API, so it must not trip the breaker
+        loop = asyncio.get_running_loop()
+        expires = None
+
+        while True:
+            try:
+                async with limit or nullcontext():
+                    if expires is None:
+                        expires = loop.time() + deadline
+                    remaining = expires - loop.time()
+                    if remaining <= 0:
+                        return self._deadline_exceeded(endpoint, url, deadline, retries, upstream=False)
+                    data = await asyncio.wait_for(
+                        hedged(lambda: self._fetch_json(url, endpoint, fields, record), hedge_delay,
+                               lambda: self._spend_retry(endpoint, 'hedges')),
+                        remaining)
+                breaker.record_success()
+                return data
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                return self._deadline_exceeded(endpoint, url, deadline, retries, upstream=True)
+            except UpstreamError as e:
+                if not e.transient:
+                    if e.status is not None:
+                        breaker.record_success()  # A 4xx: the API answered, the request itself is wrong
+                    else:
+                        breaker.record_failure()  # A 200 that cannot be used, retrying will not fix it
+                    return None
+                breaker.record_failure()
+                if not breaker.allow() or not self._spend_retry(endpoint, 'retries'):
+                    return None
+            retries += 1
+            await asyncio.sleep(min(backoff_delay(retries), max(0.0, expires - loop.time())))
+
+    def _deadline_exceeded(self, endpoint, url, deadline, retries, upstream):
+        """Give up on a call whose deadline passed, during an attempt (upstream) or while it waited for a slot."""
+        self.stats['deadline_exceeded'] += 1
+        metrics.curve_resilience_events.inc(endpoint, 'deadline_exceeded')
+        logger.error("Curve API deadline exceeded: endpoint=%s url=%s deadline=%ss retries=%s upstream=%s",
+                     endpoint, url, deadline, retries, upstream)
+        return None
+
+    async def _fetch_json(self, url, endpoint, fields=None, record=None):
+        """One attempt, raising UpstreamError on failure."""
+        if self.session is None or self.session.closed:
+            await self.start()
+
+        logger.debug("Curve API request: endpoint=%s url=%s", endpoint, url)
+
+        self.stats['requests'] += 1
+        self.stats['in_flight'] += 1
+        metrics.curve_in_flight.inc(endpoint)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.get(url) as response:
+                status = response.status
+                if response.status == 200:
+                    body = await response.read()
+                    data = extract_json(body, fields) if fields else json.loads(body)
+                    if PAYLOAD_LOG_SAMPLE_RATE and random.random() < PAYLOAD_LOG_SAMPLE_RATE:
+                        logger.debug("Curve API payload: endpoint=%s url=%s data=%s", endpoint, url, data)
+                    return record(data) if record else data
+                logger.error("Curve API error: endpoint=%s status=%s url=%s", endpoint, response.status, url)
+                self.stats['errors'] += 1
+                raise UpstreamError(f"status {response.status}",
+                                    transient=response.status == 429 or response.status >= 500, status=response.status)
+        except UpstreamError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Curve API request failed: endpoint=%s url=%s error=%r", endpoint, url, e)
+            self.stats['errors'] += 1
+            raise UpstreamError(repr(e)) from e
+        except Exception as e:
+            logger.error("Curve API request failed: endpoint=%s url=%s error=%r", endpoint, url, e)
+            self.stats['errors'] += 1
+            raise UpstreamError(repr(e), transient=False) from e
+        finally:
+            self.stats['in_flight'] -= 1
+            metrics.curve_in_flight.dec(endpoint)
+            metrics.curve_request_duration.observe(endpoint, value=time.perf_counter() - start)
+            metrics.curve_responses.inc(endpoint, str(status))
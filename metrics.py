@@ -0,0 +1,177 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Metrics endpoint
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Gauge set directly, or read from a callback at scrape time."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, *labels, value):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        values = self.values
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.error(f"Failed to collect metric {self.name}: {e}")
+                values = {}
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, *labels, value):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - start)
+
+    def render(self):
+        lines = []
+        names = self.labelnames + ('le',)
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(names, labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+registry = []
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def handle_metrics(request):
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
+
+
+# Curve API
+curve_request_duration = Histogram('curve_api_request_duration_seconds', 'Curve API request latency.', ['endpoint'])
+curve_responses = Counter('curve_api_responses_total', 'Curve API responses by status code.', ['endpoint', 'status'])
+curve_in_flight = Gauge('curve_api_in_flight_requests', 'Curve API requests in progress.', ['endpoint'])
+curve_resilience_events = Counter('curve_api_resilience_events_total',
+                                  'Curve API retries, hedged requests, calls shed by the circuit breaker and '
+                                  'deadlines exceeded.', ['endpoint', 'event'])
+
+# Chain RPC
+rpc_request_duration = Histogram('rpc_request_duration_seconds', 'JSON-RPC eth_call latency.', ['chain'])
+rpc_requests = Counter('rpc_requests_total', 'JSON-RPC eth_calls by result.', ['chain', 'result'])
+rpc_batch_size = Histogram('rpc_batch_positions', 'Positions read in one Multicall3 eth_call.', ['chain'],
+                           buckets=(1, 5, 10, 25, 50, 100, 200, 300, 500))
+
+# Monitoring
+monitor_poll_lag = Histogram('monitor_poll_lag_seconds', 'Delay between a position becoming due and its check.',
+                             buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+monitor_poll_duration = Histogram('monitor_poll_duration_seconds', 'Time to check one position.')
+monitor_discovery_duration = Histogram('monitor_discovery_duration_seconds', 'Time to look up the markets of all monitored wallets.',
+                                       buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+monitored_positions_gauge = Gauge('monitor_positions', 'Positions currently monitored.')
+
+# Startup
+startup_time_to_ready = Gauge('startup_time_to_ready_seconds', 'Seconds from start until all restored positions were checked.')
+startup_peak_requests = Gauge('startup_peak_requests_per_second', 'Highest upstream requests in one second during warm-up.')
+
+# Telegram
+notification_send_duration = Histogram('notification_send_duration_seconds', 'Telegram notification send latency.')
+notifications_sent = Counter('notifications_total', 'Notifications by result.', ['result'])
@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+import metrics
+from scheduler import RequestBudget
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and one per second per chat
+GLOBAL_SEND_RATE = 25       # Messages per second across all chats
+PER_CHAT_INTERVAL = 1.0     # Minimum seconds between messages to one chat
+COALESCE_WINDOW = 2.0       # Seconds to collect alerts for a chat before sending them as one message
+SEND_WORKERS = 4            # Concurrent send_message calls
+MAX_ATTEMPTS = 5            # Attempts per message before it is dropped
+BACKOFF_BASE = 1.0          # Seconds of the first retry delay, doubled per attempt
+MESSAGE_LIMIT = 4096        # Telegram message length limit
+
+notification_latency = metrics.Histogram('notification_delivery_latency_seconds',
+                                         'Time from queueing an alert to its delivery.',
+                                         buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+notification_queue_size = metrics.Gauge('notification_queue_chats', 'Chats with undelivered notifications.')
+
+
+class PendingChat:
+    __slots__ = ('entries', 'ready_at', 'queued_at', 'attempts')
+
+    def __init__(self, ready_at):
+        self.entries = OrderedDict()  # key -> unsent text, a newer alert for the same key replaces the older one
+        self.ready_at = ready_at
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+
+def split_entries(entries, limit=MESSAGE_LIMIT):
+    """Join (key, text) entries with blank lines into as few messages under the limit as possible.
+
+    Returns (keys, message) pairs, keys being those of the entries in the message.
+    """
+    messages = []
+    keys = []
+    current = ''
+    for key, entry in entries:
+        entry = entry[:limit]
+        candidate = f"{current}\n\n{entry}" if current else entry
+        if len(candidate) > limit:
+            messages.append((keys, current))
+            keys = []
+            candidate = entry
+        keys.append(key)
+        current = candidate
+    if current:
+        messages.append((keys, current))
+    return messages
+
+
+def split_message(entries, limit=MESSAGE_LIMIT):
+    """Join entries with blank lines into as few messages under the limit as possible."""
+    return [message for _, message in split_entries(enumerate(entries), limit)]
+
+
+class Notifier:
+    """Outbound queue for Telegram notifications.
+
+    Alerts queued for the same chat within COALESCE_WINDOW are merged into one
+    message. Sends are limited globally and per chat, and flood control
+    (RetryAfter) and transient errors are retried with backoff, so the
+    callers never wait on Telegram.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_SEND_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 coalesce_window=COALESCE_WINDOW, workers=SEND_WORKERS):
+        self.bot = bot
+        self.budget = RequestBudget(global_rate, burst=1)  # No bursts above the rate, Telegram penalizes them
+        self.per_chat_interval = per_chat_interval
+        self.coalesce_window = coalesce_window
+        self.workers = workers
+        self.pending = {}      # chat_id -> PendingChat
+        self.sending = set()   # chat_ids with a send in progress
+        self.next_allowed = {}  # chat_id -> earliest monotonic time of the next send
+        self.heap = []         # (ready_at, chat_id)
+        self.changed = asyncio.Event()
+        self.paused_until = 0.0
+        self.tasks = []
+        self.stats = {'queued': 0, 'sent': 0, 'merged': 0, 'retried': 0, 'dropped': 0}
+        notification_queue_size.callback = lambda: {(): len(self.pending)}
+
+    def enqueue(self, chat_id, key, text):
+        """Queue an alert for a chat. key identifies the position so repeated alerts replace each other."""
+        now = time.monotonic()
+        chat = self.pending.get(chat_id)
+        if chat is None:
+            ready_at = max(now + self.coalesce_window, self.next_allowed.get(chat_id, 0.0))
+            chat = self.pending[chat_id] = PendingChat(ready_at)
+            self._push(chat_id, ready_at)
+        else:
+            self.stats['merged'] += 1
+        chat.entries[key] = text
+        self.stats['queued'] += 1
+
+    def _push(self, chat_id, ready_at):
+        heapq.heappush(self.heap, (ready_at, chat_id))
+        self.changed.set()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _next_chat(self):
+        while True:
+            now = time.monotonic()
+            wait = None
+            if self.paused_until > now:
+                wait = self.paused_until - now
+            elif self.heap:
+                ready_at, chat_id = self.heap[0]
+                chat = self.pending.get(chat_id)
+                if chat is None or chat.ready_at != ready_at or chat_id in self.sending:
+                    heapq.heappop(self.heap)  # Outdated entry
+                    continue
+                if ready_at <= now:
+                    heapq.heappop(self.heap)
+                    return chat_id
+                wait = ready_at - now
+
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._next_chat()
+            chat = self.pending.pop(chat_id)
+            self.sending.add(chat_id)
+            try:
+                await self._deliver(chat_id, chat)
+            except Exception as e:
+                logger.error(f"Unexpected error while notifying chat {chat_id}: {e}")
+            finally:
+                self.sending.discard(chat_id)
+                self.next_allowed[chat_id] = time.monotonic() + self.per_chat_interval
+                # Alerts queued during the send wait for the per-chat interval
+                waiting = self.pending.get(chat_id)
+                if waiting is not None:
+                    waiting.ready_at = max(waiting.ready_at, self.next_allowed[chat_id])
+                    self._push(chat_id, waiting.ready_at)
+
+    def _retry(self, chat_id, chat, delay):
+        """Put a failed chat back in the queue, merged with anything queued for it meanwhile."""
+        chat.attempts += 1
+        if chat.attempts >= MAX_ATTEMPTS:
+            self.stats['dropped'] += 1
+            metrics.notifications_sent.inc('dropped')
+            logger.error(f"Dropping notification to chat {chat_id} after {chat.attempts} attempts")
+            return
+        self.stats['retried'] += 1
+        newer = self.pending.get(chat_id)
+        if newer is not None:
+            chat.entries.update(newer.entries)
+        chat.ready_at = time.monotonic() + delay
+        self.pending[chat_id] = chat
+
+    async def _deliver(self, chat_id, chat):
+        # Split again on every attempt: entries replaced by newer alerts since the last one are sent in their new form
+        messages = split_entries(chat.entries.items())
+        while messages:
+            keys, text = messages[0]
+            await self.budget.acquire()
+            try:
+                with metrics.notification_send_duration.time():
+                    await self.bot.send_message(chat_id, text)
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot, pause every worker
+                logger.warning(f"Telegram flood control, retrying in {e.retry_after}s")
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                self._retry(chat_id, chat, e.retry_after)
+                return
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # The user blocked the bot or the chat is gone, retrying will not help
+                self.stats['dropped'] += 1
+                metrics.notifications_sent.inc('dropped')
+                logger.error(f"Failed to send notification to chat {chat_id}: {e}")
+                return
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError) as e:
+                delay = BACKOFF_BASE * 2 ** chat.attempts * (0.5 + random.random())
+                logger.warning(f"Failed to send notification to chat {chat_id}, retrying in {delay:.1f}s: {e}")
+                metrics.notifications_sent.inc('error')
+                self._retry(chat_id, chat, delay)
+                return
+
+            messages.pop(0)
+            for key in keys:
+                del chat.entries[key]  # Sent, a retry of the rest must not repeat it
+            self.stats['sent'] += 1
+            metrics.notifications_sent.inc('sent')
+            notification_latency.observe(value=time.monotonic() - chat.queued_at)
+            if messages:
+                await asyncio.sleep(self.per_chat_interval)
@@ -0,0 +1,456 @@
+"""Where position stats come from.
+
+get_position_stats in bot.py reads from one PositionSource:
+
+- CurveApiSource asks the prices.curve.fi indexer, one /stats request per position.
+- RpcSource reads the lending controllers straight from a JSON-RPC node. Positions
+  requested within BATCH_WINDOW are packed into one Multicall3 eth_call per chain,
+  so hundreds of positions cost one round trip and the stats are as fresh as the
+  latest block.
+
+Both return the same records.PositionStats (health_full, debt, collateral,
+borrowed, soft_liquidation, oracle_price, n1, n2, block_number), or None on error.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import nullcontext
+
+import aiohttp
+
+import metrics
+from cache import ResponseCache
+from chains import chain_limits
+from records import PositionStats
+
+logger = logging.getLogger(__name__)
+
+# Multicall3 is deployed at the same address on every supported chain
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+STATS_STALE_TTL = 120  # Seconds stale stats may be served while a refresh is slow or failing
+
+# Batching
+BATCH_WINDOW = 0.05  # Seconds to collect requests before sending a batch
+MULTICALL_BATCH_SIZE = 300  # Positions per eth_call
+
+# Request timeouts (seconds)
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+
+# Function selectors (first 4 bytes of the keccak256 of the signature)
+SELECTORS = {
+    'aggregate3': '82ad56cb',  # aggregate3((address,bool,bytes)[])
+    'getBlockNumber': '42cbb15c',  # getBlockNumber()
+    'amm': '2a943945',  # amm()
+    'collateral_token': '2621db2f',  # collateral_token()
+    'borrowed_token': '765337b6',  # borrowed_token()
+    'decimals': '313ce567',  # decimals()
+    'health': '8908ea82',  # health(address,bool)
+    'user_state': 'ec74d0a8',  # user_state(address)
+    'price_oracle': '86fc88d3',  # price_oracle()
+    'read_user_tick_numbers': 'b461100d',  # read_user_tick_numbers(address)
+}
+
+# Controllers that have no borrowed_token() (crvUSD mint markets) lend crvUSD
+DEFAULT_BORROWED_DECIMALS = 18
+
+
+def rpc_urls_from_env(chains):
+    """JSON-RPC endpoints of the chains, overridden with RPC_URLS="ethereum=https://...,arbitrum=https://..."."""
+    urls = {name: chain.rpc_url for name, chain in chains.items() if chain.rpc_url}
+    for item in os.environ.get('RPC_URLS', '').split(','):
+        chain, _, url = item.partition('=')
+        if chain.strip() and url.strip():
+            urls[chain.strip()] = url.strip()
+    return urls
+
+
+# ABI encoding, just the static types and the Multicall3 structs used here
+
+def is_address(value):
+    if not isinstance(value, str) or len(value) != 42 or not value.startswith('0x'):
+        return False
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def encode_word(value):
+    """A uint256, int256, bool or address as one 32-byte word."""
+    if isinstance(value, str):
+        value = int(value, 16)
+    return (value % (1 << 256)).to_bytes(32, 'big')
+
+
+def decode_uint(data, index=0):
+    return int.from_bytes(data[32 * index:32 * index + 32], 'big')
+
+
+def decode_int(data, index=0):
+    value = decode_uint(data, index)
+    return value - (1 << 256) if value >= 1 << 255 else value
+
+
+def decode_address(data, index=0):
+    return '0x' + data[32 * index + 12:32 * index + 32].hex()
+
+
+def encode_call(function, *args):
+    return bytes.fromhex(SELECTORS[function]) + b''.join(encode_word(arg) for arg in args)
+
+
+def encode_bytes(data):
+    padding = -len(data) % 32
+    return encode_word(len(data)) + data + b'\0' * padding
+
+
+def encode_aggregate3(calls):
+    """Calldata of Multicall3.aggregate3 for [(target, allow_failure, calldata)]."""
+    heads = []
+    tails = []
+    offset = 32 * len(calls)
+    for target, allow_failure, calldata in calls:
+        heads.append(encode_word(offset))
+        tail = encode_word(target) + encode_word(int(allow_failure)) + encode_word(96) + encode_bytes(calldata)
+        tails.append(tail)
+        offset += len(tail)
+    return (bytes.fromhex(SELECTORS['aggregate3']) + encode_word(32) + encode_word(len(calls))
+            + b''.join(heads) + b''.join(tails))
+
+
+def decode_aggregate3_calls(calldata):
+    """[(target, allow_failure, calldata)] from aggregate3 calldata, the inverse of encode_aggregate3."""
+    data = calldata[4:]
+    array = data[decode_uint(data):]
+    count = decode_uint(array)
+    items = array[32:]
+    calls = []
+    for i in range(count):
+        item = items[decode_uint(items, i):]
+        payload = item[decode_uint(item, 2):]
+        calls.append((decode_address(item, 0), bool(decode_uint(item, 1)), payload[32:32 + decode_uint(payload)]))
+    return calls
+
+
+def encode_aggregate3_result(results):
+    """Return data of aggregate3 for [(success, return_data)]."""
+    heads = []
+    tails = []
+    offset = 32 * len(results)
+    for success, return_data in results:
+        heads.append(encode_word(offset))
+        tail = encode_word(int(success)) + encode_word(64) + encode_bytes(return_data)
+        tails.append(tail)
+        offset += len(tail)
+    return encode_word(32) + encode_word(len(results)) + b''.join(heads) + b''.join(tails)
+
+
+def decode_aggregate3_result(data):
+    """[(success, return_data)] from the return data of aggregate3."""
+    array = data[decode_uint(data):]
+    count = decode_uint(array)
+    items = array[32:]
+    results = []
+    for i in range(count):
+        item = items[decode_uint(items, i):]
+        payload = item[decode_uint(item, 1):]
+        results.append((bool(decode_uint(item, 0)), payload[32:32 + decode_uint(payload)]))
+    return results
+
+
+class PositionSource:
+    """Reads the current stats of lending positions."""
+
+    def __init__(self):
+        self.stats = {'requests': 0, 'errors': 0}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_position_stats(self, chain, wallet, controller):
+        raise NotImplementedError
+
+    def prime(self, chain, wallet, controller, stats, stale_ttl):
+        """Keep already known stats to serve while the first refresh is slow or failing."""
+
+    def cached_stats(self, chain, wallet, controller, max_age):
+        """Stats read within the last max_age seconds, without a request; None if there are none."""
+        return None
+
+    def invalidate(self, chain, wallet, controller):
+        """Forget cached stats, so the next read goes upstream."""
+
+
+class CurveApiSource(PositionSource):
+    """Position stats from the prices.curve.fi /stats endpoint, through the shared CurveClient."""
+
+    def __init__(self, client, limits=None):
+        self.client = client
+        self.limits = limits or {}  # chain -> Semaphore
+
+    @property
+    def stats(self):
+        return self.client.stats
+
+    @staticmethod
+    def path(chain, wallet, controller):
+        return f"/v1/lending/users/{chain}/{wallet}/{controller}/stats"
+
+    async def get_position_stats(self, chain, wallet, controller):
+        return await self.client.get_json(self.path(chain, wallet, controller), endpoint='stats',
+                                          limit=self.limits.get(chain), record=PositionStats.from_json)
+
+    def prime(self, chain, wallet, controller, stats, stale_ttl):
+        self.client.cache.prime(self.path(chain, wallet, controller), stats, stale_ttl)
+
+    def cached_stats(self, chain, wallet, controller, max_age):
+        return self.client.cache.peek(self.path(chain, wallet, controller), max_age)
+
+    def invalidate(self, chain, wallet, controller):
+        self.client.cache.invalidate(self.path(chain, wallet, controller))
+
+
+class RpcError(Exception):
+    pass
+
+
+class RpcSource(PositionSource):
+    """Position stats read from the lending controllers and their AMMs over JSON-RPC.
+
+    Each position costs three calls (health, user_state, read_user_tick_numbers)
+    and each market one more (price_oracle); all of them go into one Multicall3
+    aggregate3 eth_call together with getBlockNumber, with up to batch_size
+    positions per call. The AMM and token decimals of new markets are read once,
+    for all markets of a batch together. Results are cached for a block, and
+    concurrent requests for the same position share one read.
+    """
+
+    def __init__(self, rpc_urls, block_times=None, limits=None, batch_size=MULTICALL_BATCH_SIZE,
+                 batch_window=BATCH_WINDOW, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        super().__init__()
+        self.rpc_urls = rpc_urls
+        self.block_times = block_times or {}  # chain -> seconds, how long read stats are reused
+        self.limits = limits or {}  # chain -> Semaphore on eth_calls
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout,
+                                             sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+        self.cache = ResponseCache()
+        self.markets = {}  # (chain, controller) -> (amm, collateral_decimals, borrowed_decimals)
+        self.market_locks = {}  # chain -> asyncio.Lock, so concurrent batches read new markets once
+        self.pending = {}  # chain -> {(wallet, controller): Future}
+        self.flush_timers = {}  # chain -> TimerHandle
+        self.batches = set()  # Running batch tasks
+        self.request_id = 0
+        self.stats.update({'positions': 0, 'batches': 0})
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+            logger.info(f"JSON-RPC position source started for {', '.join(self.rpc_urls)}")
+
+    async def close(self):
+        for timer in self.flush_timers.values():
+            timer.cancel()
+        self.flush_timers.clear()
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    @staticmethod
+    def cache_key(chain, wallet, controller):
+        return (chain, wallet.lower(), controller.lower())
+
+    async def get_position_stats(self, chain, wallet, controller):
+        if chain not in self.rpc_urls or not is_address(wallet) or not is_address(controller):
+            return None
+        key = self.cache_key(chain, wallet, controller)
+        return await self.cache.get(key, lambda: self.read_position(*key), self.block_times.get(chain, 1),
+                                    STATS_STALE_TTL)
+
+    def prime(self, chain, wallet, controller, stats, stale_ttl):
+        self.cache.prime(self.cache_key(chain, wallet, controller), stats, stale_ttl)
+
+    def cached_stats(self, chain, wallet, controller, max_age):
+        return self.cache.peek(self.cache_key(chain, wallet, controller), max_age)
+
+    def invalidate(self, chain, wallet, controller):
+        self.cache.invalidate(self.cache_key(chain, wallet, controller))
+
+    def read_position(self, chain, wallet, controller):
+        """Queue a position for the next batch of its chain, the returned future resolves with its stats."""
+        pending = self.pending.setdefault(chain, {})
+        future = pending.get((wallet, controller))
+        if future is None:
+            future = pending[(wallet, controller)] = asyncio.get_running_loop().create_future()
+            if len(pending) >= self.batch_size:
+                self.flush(chain)
+            elif chain not in self.flush_timers:
+                self.flush_timers[chain] = asyncio.get_running_loop().call_later(self.batch_window, self.flush, chain)
+        return future
+
+    def flush(self, chain):
+        timer = self.flush_timers.pop(chain, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(chain, None)
+        if batch:
+            task = asyncio.create_task(self.run_batch(chain, batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def run_batch(self, chain, batch):
+        results = {}
+        try:
+            results = await self.read_batch(chain, list(batch))
+        except Exception as e:
+            logger.error("JSON-RPC batch failed: chain=%s positions=%s error=%r", chain, len(batch), e)
+        for position, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(position))
+
+    async def eth_call(self, chain, calls):
+        """Run [(target, allow_failure, calldata)] through Multicall3, returning [(success, return_data)]."""
+        if self.session is None or self.session.closed:
+            await self.start()
+        self.request_id += 1
+        payload = {'jsonrpc': '2.0', 'id': self.request_id, 'method': 'eth_call',
+                   'params': [{'to': MULTICALL3_ADDRESS, 'data': '0x' + encode_aggregate3(calls).hex()}, 'latest']}
+        async with self.limits.get(chain) or nullcontext():
+            return await self.post(chain, payload)
+
+    async def post(self, chain, payload):
+        self.stats['requests'] += 1
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.post(self.rpc_urls[chain], json=payload) as response:
+                if response.status != 200:
+                    raise RpcError(f"HTTP {response.status}")
+                reply = await response.json(content_type=None)
+            if 'error' in reply:
+                raise RpcError(reply['error'])
+            status = 'ok'
+            return decode_aggregate3_result(bytes.fromhex(reply['result'][2:]))
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            metrics.rpc_request_duration.observe(chain, value=time.perf_counter() - start)
+            metrics.rpc_requests.inc(chain, status)
+
+    async def load_markets(self, chain, controllers):
+        """Read the AMM and token decimals of markets not seen before, two eth_calls for all of them."""
+        lock = self.market_locks.setdefault(chain, asyncio.Lock())
+        async with lock:
+            controllers = [controller for controller in controllers if (chain, controller) not in self.markets]
+            if not controllers:
+                return
+            calls = []
+            for controller in controllers:
+                calls += [
+                    (controller, True, encode_call('amm')),
+                    (controller, True, encode_call('collateral_token')),
+                    (controller, True, encode_call('borrowed_token')),
+                ]
+            results = await self.eth_call(chain, calls)
+            tokens = {}
+            for i, controller in enumerate(controllers):
+                (amm_ok, amm), (collateral_ok, collateral), (borrowed_ok, borrowed) = results[3 * i:3 * i + 3]
+                if not amm_ok or not collateral_ok:
+                    logger.error("Not a lending controller: chain=%s controller=%s", chain, controller)
+                    continue
+                tokens[controller] = (decode_address(amm), decode_address(collateral),
+                                      decode_address(borrowed) if borrowed_ok else None)
+            if not tokens:
+                return
+
+            addresses = sorted({token for _, *pair in tokens.values() for token in pair if token is not None})
+            results = await self.eth_call(chain, [(address, True, encode_call('decimals')) for address in addresses])
+            decimals = {address: decode_uint(data) for address, (ok, data) in zip(addresses, results) if ok}
+            for controller, (amm, collateral, borrowed) in tokens.items():
+                if collateral in decimals:
+                    self.markets[(chain, controller)] = (amm, decimals[collateral],
+                                                         decimals.get(borrowed, DEFAULT_BORROWED_DECIMALS))
+
+    async def read_batch(self, chain, positions):
+        controllers = sorted({controller for _, controller in positions})
+        await self.load_markets(chain, controllers)
+        markets = {controller: self.markets[(chain, controller)] for controller in controllers
+                   if (chain, controller) in self.markets}
+        positions = [position for position in positions if position[1] in markets]
+        if not positions:
+            return {}
+
+        calls = [(MULTICALL3_ADDRESS, False, encode_call('getBlockNumber'))]
+        calls += [(markets[controller][0], True, encode_call('price_oracle')) for controller in markets]
+        for wallet, controller in positions:
+            calls += [
+                (controller, True, encode_call('health', wallet, True)),
+                (controller, True, encode_call('user_state', wallet)),
+                (markets[controller][0], True, encode_call('read_user_tick_numbers', wallet)),
+            ]
+        metrics.rpc_batch_size.observe(chain, value=len(positions))
+        results = await self.eth_call(chain, calls)
+        self.stats['batches'] += 1
+        self.stats['positions'] += len(positions)
+
+        block_number = decode_uint(results[0][1])
+        prices = dict(zip(markets, results[1:1 + len(markets)]))
+        stats = {}
+        offset = 1 + len(markets)
+        for i, (wallet, controller) in enumerate(positions):
+            health, state, ticks = results[offset + 3 * i:offset + 3 * i + 3]
+            price_ok, price = prices[controller]
+            stats[(wallet, controller)] = position_stats(markets[controller], block_number, health, state, ticks,
+                                                         decode_uint(price) / 1e18 if price_ok else None)
+        return stats
+
+
+def position_stats(market, block_number, health, state, ticks, oracle_price):
+    """PositionStats from the results of one position's calls, as the Curve API would report them."""
+    _, collateral_decimals, borrowed_decimals = market
+    state_ok, state = state
+    if not state_ok or oracle_price is None:
+        return None
+    collateral, borrowed, debt, _ = (decode_uint(state, i) for i in range(4))
+    if debt == 0:
+        # No loan: health() reverts, report an empty position like the Curve API does
+        return PositionStats(health_full=0.0, debt=0.0, oracle_price=oracle_price, block_number=block_number)
+    health_ok, health = health
+    ticks_ok, ticks = ticks
+    if not health_ok or not ticks_ok:
+        return None
+    return PositionStats(
+        health_full=decode_int(health) / 1e16,  # 1e18 is 100%
+        debt=debt / 10 ** borrowed_decimals,
+        collateral=collateral / 10 ** collateral_decimals,
+        borrowed=borrowed / 10 ** borrowed_decimals,
+        # Part of the collateral has been converted when the bands hold borrowed tokens
+        soft_liquidation=borrowed > 0,
+        oracle_price=oracle_price,
+        n1=decode_int(ticks, 0),
+        n2=decode_int(ticks, 1),
+        block_number=block_number,
+    )
+
+
+def create_position_source(name, client, chains, api_limits=None):
+    """The position source for the POSITION_SOURCE setting: 'api' (default) or 'rpc'.
+
+    api_limits are the per-chain limits shared with the other Curve API calls.
+    """
+    if name == 'rpc':
+        return RpcSource(rpc_urls_from_env(chains), {name: chain.block_time for name, chain in chains.items()},
+                         chain_limits(chains))
+    if name != 'api':
+        logger.error(f"Unknown position source {name!r}, using the Curve API")
+    return CurveApiSource(client, api_limits)
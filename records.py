@@ -0,0 +1,78 @@
+"""Compact records for what the bot keeps per market and per position, and selective JSON decoding.
+
+API responses are dicts of a dozen or more fields, most of which the bot
+never reads. PositionStats keeps only the fields in use, in __slots__ without
+a per-instance __dict__. The chain, wallet, controller and market name
+strings are interned, so the many structures keyed by the same position share
+one copy instead of one per response they were decoded from.
+
+extract_json() decodes a response keeping only named keys. Objects are pruned
+as the decoder finishes each one, so the full document is never built in
+memory: of a market list only the few fields of each market survive.
+"""
+import json
+import sys
+
+
+def intern_text(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def intern_key(*parts):
+    """Position or wallet key with interned strings."""
+    return tuple(intern_text(part) for part in parts)
+
+
+def intern_markets(markets):
+    """{controller: market_name} with interned strings."""
+    return {intern_text(controller): intern_text(market_name) for controller, market_name in markets.items()}
+
+
+def extract_json(body, fields):
+    """Decode JSON keeping only the keys in fields, at every level (containers need their key listed too)."""
+    fields = frozenset(fields)
+    return json.loads(body, object_pairs_hook=lambda pairs: {key: value for key, value in pairs if key in fields})
+
+
+class PositionStats:
+    """Stats of one position: the fields of a /stats response that the bot reads.
+
+    Indexing and get() work like on the response dict, so stats['debt'] and
+    stats.get('soft_liquidation') read the same whichever they are.
+    """
+
+    __slots__ = ('health_full', 'debt', 'collateral', 'borrowed', 'oracle_price', 'n1', 'n2', 'soft_liquidation',
+                 'block_number')
+
+    def __init__(self, health_full, debt, collateral=0.0, borrowed=0.0, oracle_price=None, n1=0, n2=0,
+                 soft_liquidation=False, block_number=None):
+        self.health_full = health_full
+        self.debt = debt
+        self.collateral = collateral
+        self.borrowed = borrowed
+        self.oracle_price = oracle_price
+        self.n1 = n1
+        self.n2 = n2
+        self.soft_liquidation = soft_liquidation
+        self.block_number = block_number
+
+    @classmethod
+    def from_json(cls, data):
+        """From a /stats response (or a saved _asdict()), None if data is None."""
+        if data is None:
+            return None
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self.__slots__ else default
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"PositionStats({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
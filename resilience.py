@@ -0,0 +1,146 @@
+"""Guards for calls to an upstream service: retry budget, circuit breaker, backoff and hedging.
+
+A call gets a deadline for all of its attempts together. Transient failures
+(timeouts, connection errors, 429 and 5xx) are retried after a jittered,
+exponentially growing delay, but only while the shared RetryBudget has
+tokens, so a failing upstream sees a bounded share of extra requests instead
+of a retry storm. A CircuitBreaker per endpoint stops calls altogether after
+repeated failures and lets a single probe through once it has cooled down.
+A call still waiting after its hedge delay is raced against a duplicate, which
+also costs a retry token.
+"""
+import asyncio
+import random
+import time
+
+# Retry budget: retries and hedges allowed on top of first attempts
+RETRY_BUDGET_RATIO = 0.1        # Tokens earned per first attempt
+RETRY_BUDGET_MIN_PER_SECOND = 1.0  # Tokens earned per second regardless of traffic
+RETRY_BUDGET_MAX_TOKENS = 20    # Tokens that can be saved up
+
+# Backoff between attempts (seconds)
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 5.0
+
+# Circuit breaker
+BREAKER_FAILURE_THRESHOLD = 10  # Consecutive failures that open the breaker
+BREAKER_COOLDOWN = 30.0         # Seconds the breaker stays open before letting a probe through
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class UpstreamError(Exception):
+    """A failed attempt; transient ones are worth retrying.
+
+    status is the HTTP status of an answered request, None if the request
+    failed or its answer could not be used.
+    """
+
+    def __init__(self, message, transient=True, status=None):
+        super().__init__(message)
+        self.transient = transient
+        self.status = status
+
+
+class RetryBudget:
+    """Token bucket allowing retries as a share of recent first attempts.
+
+    Every first attempt deposits ratio tokens and every retry or hedge takes
+    one, so retries stay around ratio of the traffic however many callers are
+    failing at once. min_per_second tokens trickle in on their own, letting a
+    quiet client retry at all.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND,
+                 max_tokens=RETRY_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+
+    def _refill(self, amount=0.0):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second + amount)
+        self.updated = now
+
+    def deposit(self):
+        self._refill(self.ratio)
+
+    def try_withdraw(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """Closed until failure_threshold consecutive failures, then open for cooldown seconds.
+
+    An open breaker refuses calls. After the cooldown it is half-open and lets
+    one call through: success closes it, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter delay before retry number attempt (1 for the first retry)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def hedged(attempt, hedge_delay, may_hedge):
+    """Run attempt(), racing a second attempt() if the first is still running after hedge_delay.
+
+    may_hedge() is asked before the duplicate starts. The first attempt to
+    succeed wins and the other is cancelled; if both fail, the error of the
+    last one to finish is raised.
+    """
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done and may_hedge():
+                tasks.append(asyncio.ensure_future(attempt()))
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Polling interval bounds (seconds)
+MIN_POLL_INTERVAL = 10
+MAX_POLL_INTERVAL = 3600
+ERROR_POLL_INTERVAL = 60  # Retry delay after a failed fetch
+
+# Seconds of polling interval per health point of margin above the threshold
+SECONDS_PER_HEALTH_POINT = 60
+# Fraction of the projected time to reach the threshold used as the interval
+TIME_TO_THRESHOLD_FRACTION = 0.1
+
+
+def poll_interval(margin, health_rate, soft_liquidation):
+    """Seconds until a position should be checked again.
+
+    margin is the health above the closest user threshold, health_rate the
+    recent change of health per hour (negative when falling).
+    """
+    if soft_liquidation or margin <= 0:
+        return MIN_POLL_INTERVAL
+
+    interval = margin * SECONDS_PER_HEALTH_POINT
+    if health_rate is not None and health_rate < 0:
+        hours_to_threshold = margin / -health_rate
+        interval = min(interval, hours_to_threshold * 3600 * TIME_TO_THRESHOLD_FRACTION)
+    return max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, interval))
+
+
+class PollScheduler:
+    """Priority queue of positions waiting for their next check.
+
+    Positions wait in a heap ordered by due time. Once due, they move to a
+    ready heap ordered by priority (lower is more urgent), so when requests
+    are scarce the riskiest due positions are fetched first.
+    """
+
+    def __init__(self):
+        self.waiting = []  # (due, version, key)
+        self.ready = []    # (priority, due, version, key)
+        self.entries = {}  # key -> (due, priority, version)
+        self.versions = itertools.count()
+        self.changed = asyncio.Event()  # Set whenever a key is scheduled
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, delay, priority):
+        due = time.monotonic() + delay
+        version = next(self.versions)
+        self.entries[key] = (due, priority, version)
+        heapq.heappush(self.waiting, (due, version, key))
+        self.changed.set()
+
+    def remove(self, key):
+        # Heap items of removed keys are skipped lazily
+        self.entries.pop(key, None)
+
+    def _is_current(self, key, version):
+        entry = self.entries.get(key)
+        return entry is not None and entry[2] == version
+
+    def _promote(self, now):
+        while self.waiting and self.waiting[0][0] <= now:
+            due, version, key = heapq.heappop(self.waiting)
+            if self._is_current(key, version):
+                heapq.heappush(self.ready, (self.entries[key][1], due, version, key))
+
+    def has_ready(self, now=None):
+        self._promote(time.monotonic() if now is None else now)
+        while self.ready and not self._is_current(self.ready[0][3], self.ready[0][2]):
+            heapq.heappop(self.ready)
+        return bool(self.ready)
+
+    def pop_ready(self, now=None):
+        """Remove and return (key, due time) of the most urgent due key, or None if nothing is due."""
+        if not self.has_ready(now):
+            return None
+        _, due, _, key = heapq.heappop(self.ready)
+        del self.entries[key]
+        return key, due
+
+    async def wait(self, timeout):
+        """Sleep until timeout passes or a key is scheduled."""
+        self.changed.clear()
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def time_until_next(self, now=None):
+        now = time.monotonic() if now is None else now
+        while self.waiting and not self._is_current(self.waiting[0][2], self.waiting[0][1]):
+            heapq.heappop(self.waiting)
+        return max(0.0, self.waiting[0][0] - now) if self.waiting else None
+
+
+class RequestBudget:
+    """Token bucket limiting the rate of upstream requests."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
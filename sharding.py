@@ -0,0 +1,381 @@
+"""Sharded monitoring: the Telegram front-end hands wallets to worker processes.
+
+The front-end process runs a ShardCoordinator. Workers connect to it over a
+local TCP socket and exchange newline-delimited JSON messages. Monitored
+wallets are spread across workers with a consistent hash ring, so when a
+worker joins or leaves only its share of wallets moves. Every user whose
+wallets a worker owns is sent to it with just those wallets; the worker runs
+the normal position monitor on them and forwards alerts back to the
+front-end, which delivers them through its single Notifier. The worker with
+the lowest id is the leader and owns the borrow rate updater; its rates are
+passed on to the front-end and the other workers.
+
+Each worker gets an equal share of the monitor request budget and retry
+budget, so N workers together stay within the limits of one process. The
+front-end owns the wallet lookups of /set and passes their markets to the
+owning worker; the lookups workers make while monitoring are passed back, so
+both market indexes stay current.
+
+The front-end remembers when every relayed alert was sent and hands those
+times to a worker together with the users it is assigned, so alerts already
+sent by the previous owner stay suppressed whether a worker joins or leaves.
+Workers also share the monitor state database, save their state when they
+stop (on SIGTERM too) and load what it holds for users handed to them, which
+covers alerts sent before the front-end started.
+
+Start a worker by hand: python sharding.py --worker-id worker-3 --port 8790
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Coordinator address
+SHARD_HOST = '127.0.0.1'
+SHARD_PORT = 8790
+
+# Points per worker on the hash ring, more points spread wallets more evenly
+VIRTUAL_NODES = 100
+
+# Seconds a worker gets to save its state after SIGTERM
+WORKER_STOP_TIMEOUT = 10
+
+# Largest message line (user assignments can be big)
+MAX_LINE = 64 * 1024 * 1024
+
+
+def stable_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes."""
+
+    def __init__(self, nodes=(), vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self.points = []  # sorted hashes
+        self.owners = {}  # hash -> node
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = stable_hash(f"{node}#{i}")
+            self.owners[point] = node
+            bisect.insort(self.points, point)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for i in range(self.vnodes):
+            point = stable_hash(f"{node}#{i}")
+            if self.owners.get(point) == node:
+                del self.owners[point]
+                self.points.pop(bisect.bisect_left(self.points, point))
+
+    def get(self, key):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, stable_hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+
+def normalize_wallet(wallet):
+    return wallet.strip().lower()
+
+
+async def send_message(writer, message):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+class ShardCoordinator:
+    """Front-end side: tracks workers, assigns wallets and relays alerts and borrow rates."""
+
+    def __init__(self, user_data, on_alert, on_borrow_rates, on_markets=None, host=SHARD_HOST, port=SHARD_PORT):
+        self.user_data = user_data
+        self.on_alert = on_alert
+        self.on_borrow_rates = on_borrow_rates
+        self.on_markets = on_markets
+        self.host = host
+        self.port = port
+        self.ring = HashRing()
+        self.workers = {}  # worker_id -> StreamWriter
+        self.leader = None
+        self.borrow_rates = None  # Latest rates from the leader, sent to workers that join later
+        self.notifications = {}  # user_id -> {position_key: sent_at} of the relayed alerts
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=MAX_LINE)
+        logger.info(f"Shard coordinator listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.workers.values()):
+            writer.close()
+
+    def owns(self, worker_id, wallet):
+        return bool(normalize_wallet(wallet)) and self.ring.get(normalize_wallet(wallet)) == worker_id
+
+    def worker_users(self, worker_id):
+        """Monitored users of a worker, each with only the wallets the worker owns."""
+        users = {}
+        for user_id, data in list(self.user_data.items()):
+            if not data.get('monitoring_active', False):
+                continue
+            wallets = [wallet for wallet in data.get('wallets', []) if self.owns(worker_id, wallet)]
+            if wallets:
+                users[user_id] = dict(data, wallets=wallets)
+        return users
+
+    def user_notifications(self, user_ids):
+        """(user_id, position_key, sent_at) of the alerts relayed to the given users."""
+        return [(user_id, position_key, sent_at) for user_id in user_ids
+                for position_key, sent_at in self.notifications.get(user_id, {}).items()]
+
+    async def rebalance(self):
+        self.leader = min(self.workers) if self.workers else None
+        logger.info(f"Rebalancing monitoring across {len(self.workers)} workers, leader {self.leader}")
+        for worker_id, writer in list(self.workers.items()):
+            try:
+                users = self.worker_users(worker_id)
+                await send_message(writer, {'type': 'assign', 'users': users, 'leader': worker_id == self.leader,
+                                            'share': 1 / len(self.workers),
+                                            'notifications': self.user_notifications(users)})
+                if self.borrow_rates is not None:
+                    await send_message(writer, {'type': 'borrow_rates', 'rates': self.borrow_rates})
+            except (ConnectionError, RuntimeError) as e:
+                logger.error(f"Failed to send assignment to {worker_id}: {e}")
+
+    async def user_changed(self, user_id, markets=()):
+        """Send a user's current settings to every worker, each with only its own wallets.
+
+        markets are [chain, wallet, looked_up_at, {controller: market_name}] rows the
+        front-end just looked up; each worker gets those of its wallets for its market index.
+        """
+        data = self.user_data.get(user_id, {})
+        for worker_id, writer in list(self.workers.items()):
+            wallets = [wallet for wallet in data.get('wallets', []) if self.owns(worker_id, wallet)]
+            try:
+                await send_message(writer, {'type': 'user', 'user_id': user_id, 'data': dict(data, wallets=wallets),
+                                            'markets': [row for row in markets if self.owns(worker_id, row[1])],
+                                            'notifications': self.user_notifications([user_id])})
+            except (ConnectionError, RuntimeError) as e:
+                logger.error(f"Failed to send user update to {worker_id}: {e}")
+
+    async def handle_connection(self, reader, writer):
+        worker_id = None
+        try:
+            hello = json.loads(await reader.readline() or b'{}')
+            if hello.get('type') != 'hello' or not hello.get('worker_id'):
+                return
+            worker_id = hello['worker_id']
+            if worker_id in self.workers:
+                logger.error(f"Worker {worker_id} is already connected, refusing the duplicate")
+                worker_id = None
+                return
+            self.workers[worker_id] = writer
+            self.ring.add(worker_id)
+            logger.info(f"Worker {worker_id} joined")
+            await self.rebalance()
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message['type'] == 'alert':
+                    self.notifications.setdefault(message['chat_id'], {})[message['key']] = message['sent_at']
+                    self.on_alert(message['chat_id'], message['key'], message['text'])
+                elif message['type'] == 'markets':
+                    if self.on_markets is not None:
+                        self.on_markets(message['rows'])
+                elif message['type'] == 'borrow_rates' and worker_id == self.leader:
+                    self.borrow_rates = message['rates']
+                    self.on_borrow_rates(message['rates'])
+                    for other_id, other in list(self.workers.items()):
+                        if other_id != worker_id:
+                            await send_message(other, message)
+        except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Connection to worker {worker_id} failed: {e}")
+        finally:
+            writer.close()
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+                self.ring.remove(worker_id)
+                logger.info(f"Worker {worker_id} left")
+                await self.rebalance()
+
+
+class AlertForwarder:
+    """Stands in for the Notifier inside a worker, passing alerts (and wallet lookups) to the front-end."""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def enqueue(self, chat_id, key, text):
+        self.writer.write(json.dumps({'type': 'alert', 'chat_id': chat_id, 'key': key, 'text': text,
+                                      'sent_at': time.time()}).encode() + b'\n')
+
+    def forward_markets(self, chain, wallet, looked_up_at, markets):
+        self.writer.write(json.dumps({'type': 'markets', 'rows': [[chain, wallet, looked_up_at, markets]]}).encode()
+                          + b'\n')
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+async def run_worker(worker_id, host=SHARD_HOST, port=SHARD_PORT):
+    import bot  # The worker runs the bot's own monitoring code
+
+    reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+    await send_message(writer, {'type': 'hello', 'worker_id': worker_id})
+    bot.notifier = AlertForwarder(writer)
+    bot.market_index_forwarder = bot.notifier.forward_markets
+
+    await bot.health_store.open()
+    await bot.monitor_state_store.open()
+    await bot.market_index_store.open()
+    await bot.load_market_index()
+    await bot.curve_client.start()
+    await bot.position_source.start()
+    monitor = asyncio.create_task(bot.position_monitor())
+    flusher = asyncio.create_task(bot.monitor_state_flusher())
+    rate_updater = None
+    restored = False
+    # Limits of the whole monitor, of which the coordinator assigns this worker a share
+    request_budget = bot.request_budget
+    retry_budget = bot.curve_client.retry_budget
+    full_rate, full_burst = request_budget.rate, request_budget.burst
+    full_retry_rate, full_retry_tokens = retry_budget.min_per_second, retry_budget.max_tokens
+
+    def apply_share(share):
+        request_budget.rate = full_rate * share
+        request_budget.burst = max(1.0, full_burst * share)  # A request needs a whole token
+        request_budget.tokens = min(request_budget.tokens, request_budget.burst)
+        retry_budget.min_per_second = full_retry_rate * share
+        retry_budget.max_tokens = max(1.0, full_retry_tokens * share)
+        retry_budget.tokens = min(retry_budget.tokens, retry_budget.max_tokens)
+
+    async def lead_borrow_rates():
+        while True:
+            try:
+                await bot.update_borrow_rates()
+                await send_message(writer, {'type': 'borrow_rates', 'rates': bot.borrow_rates_rows()})
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed to update borrow rates: {e!r}")
+            await asyncio.sleep(bot.BORROW_RATES_INTERVAL)
+
+    def new_users(users):
+        """Ids of the users that come with wallets this worker did not monitor for them yet."""
+        return [user_id for user_id, data in users.items()
+                if not set(data.get('wallets', [])) <= set(dict.get(bot.user_data, user_id, {}).get('wallets', []))]
+
+    # Stop like on a lost coordinator, saving the monitor state for the worker taking over
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    logger.info(f"Worker {worker_id} connected to {host}:{port}")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                logger.info(f"Worker {worker_id} lost the coordinator, exiting")
+                break
+            message = json.loads(line)
+            if message['type'] == 'assign':
+                handed_over = new_users(message['users'])
+                apply_share(message['share'])
+                bot.replace_user_data(message['users'])
+                if not restored:
+                    # Suppressed alerts and last stats of this worker's share from before the restart
+                    await bot.restore_monitor_state()
+                    restored = True
+                elif handed_over:
+                    # Alerts another worker saved for these users, from before the front-end started
+                    await bot.restore_notifications(handed_over)
+                # Alerts relayed for these users, including the ones their previous worker has not saved yet
+                bot.merge_notifications(message['notifications'])
+                asyncio.create_task(bot.discover_positions())
+                if message['leader'] and rate_updater is None:
+                    rate_updater = asyncio.create_task(lead_borrow_rates())
+                elif not message['leader'] and rate_updater is not None:
+                    rate_updater.cancel()
+                    rate_updater = None
+            elif message['type'] == 'user':
+                handed_over = new_users({message['user_id']: message['data']})
+                dict.__setitem__(bot.user_data, message['user_id'], message['data'])
+                if handed_over:
+                    await bot.restore_notifications(handed_over)
+                bot.merge_notifications(message['notifications'])
+                # The front-end has just looked up changed wallets, only the market index needs them
+                bot.apply_wallet_markets(message['markets'])
+                asyncio.create_task(bot.discover_positions([message['user_id']]))
+            elif message['type'] == 'borrow_rates':
+                bot.apply_borrow_rates(message['rates'])
+    except asyncio.CancelledError:
+        logger.info(f"Worker {worker_id} received SIGTERM, exiting")
+    finally:
+        monitor.cancel()
+        flusher.cancel()
+        if rate_updater is not None:
+            rate_updater.cancel()
+        await bot.flush_monitor_state()
+        await bot.position_source.close()
+        await bot.curve_client.close()
+        bot.health_store.close()
+        bot.monitor_state_store.close()
+        bot.market_index_store.close()
+        writer.close()
+
+
+async def spawn_workers(count, port=SHARD_PORT):
+    """Start count worker processes next to this file."""
+    script = os.path.abspath(__file__)
+    return [
+        await asyncio.create_subprocess_exec(sys.executable, script, '--worker-id', f"worker-{i}", '--port', str(port),
+                                             cwd=os.getcwd())
+        for i in range(count)
+    ]
+
+
+async def stop_workers(workers, timeout=WORKER_STOP_TIMEOUT):
+    """SIGTERM the worker processes and give them timeout seconds to save their state and exit."""
+    for worker in workers:
+        if worker.returncode is None:
+            worker.terminate()
+    if workers:
+        _, pending = await asyncio.wait([asyncio.ensure_future(worker.wait()) for worker in workers], timeout=timeout)
+        if pending:
+            logger.error(f"{len(pending)} workers did not exit within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-id', required=True)
+    parser.add_argument('--host', default=SHARD_HOST)
+    parser.add_argument('--port', type=int, default=SHARD_PORT)
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.worker_id, args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
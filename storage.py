@@ -0,0 +1,411 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from records import PositionStats, intern_key, intern_text
+
+logger = logging.getLogger(__name__)
+
+# SQLite database with user settings
+DB_FILE = 'user_data.db'
+
+# SQLite database with the health history of positions
+HEALTH_DB_FILE = 'health.db'
+
+# SQLite database with monitor state kept across restarts
+MONITOR_STATE_DB_FILE = 'monitor_state.db'
+
+# SQLite database with the markets each wallet has a position in
+MARKET_INDEX_DB_FILE = 'market_index.db'
+
+# Bound parameters per statement, below SQLite's default limit of 999
+SQLITE_MAX_PARAMS = 500
+
+
+class UserStore:
+    """Per-user settings stored in SQLite (WAL mode).
+
+    Each update writes only one user's row in its own transaction, so the cost
+    of a save does not depend on the number of users and a crash never leaves
+    a half-written file behind. Writes run on a single background thread to
+    keep them off the event loop and in order.
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.conn = None
+        self.reader = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-store')
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS users ('
+                          'user_id TEXT PRIMARY KEY, '
+                          'monitoring_active INTEGER NOT NULL DEFAULT 0, '
+                          'data TEXT NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS users_monitoring ON users (monitoring_active)')
+        self.conn.commit()
+        # Separate connection for reads from the event loop, WAL lets it run alongside writes
+        self.reader = sqlite3.connect(self.path, check_same_thread=False)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for conn in (self.conn, self.reader):
+            if conn is not None:
+                conn.close()
+        self.conn = self.reader = None
+
+    def migrate_json(self, json_path):
+        """Import users from the old whole-file JSON store once, then rename the file."""
+        if not os.path.exists(json_path):
+            return 0
+        if self.conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            logger.warning(f"{json_path} found but {self.path} already has users, skipping migration.")
+            return 0
+
+        with open(json_path, 'r') as f:
+            users = json.load(f)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO users (user_id, monitoring_active, data) VALUES (?, ?, ?)',
+                [(user_id, int(bool(data.get('monitoring_active', False))), json.dumps(data))
+                 for user_id, data in users.items()]
+            )
+        os.replace(json_path, json_path + '.migrated')
+        logger.info(f"Migrated {len(users)} users from {json_path} to {self.path}.")
+        return len(users)
+
+    def load_user(self, user_id):
+        row = self.reader.execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_active_users(self):
+        rows = self.reader.execute('SELECT user_id, data FROM users WHERE monitoring_active = 1')
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def write_user(self, user_id, monitoring_active, data_json):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO users (user_id, monitoring_active, data) VALUES (?, ?, ?)',
+                (user_id, monitoring_active, data_json)
+            )
+
+    async def save_user(self, user_id, data):
+        # Serialize now so later changes to the dict don't race with the background write
+        monitoring_active = int(bool(data.get('monitoring_active', False)))
+        data_json = json.dumps(data)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.write_user, user_id, monitoring_active, data_json)
+
+
+class UserData(dict):
+    """In-memory user settings that load users from the store on first access.
+
+    Users with active monitoring are loaded at startup because the monitor
+    iterates over them; everyone else is read only when they send a command.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.missing = set()
+
+    def load_active(self):
+        self.update(self.store.load_active_users())
+        logger.info(f"Loaded {len(self)} users with active monitoring.")
+
+    def _load(self, user_id):
+        if dict.__contains__(self, user_id) or user_id in self.missing or self.store.reader is None:
+            return
+        data = self.store.load_user(user_id)
+        if data is None:
+            self.missing.add(user_id)
+        else:
+            dict.__setitem__(self, user_id, data)
+
+    def __contains__(self, user_id):
+        self._load(user_id)
+        return dict.__contains__(self, user_id)
+
+    def __getitem__(self, user_id):
+        self._load(user_id)
+        return dict.__getitem__(self, user_id)
+
+    def __setitem__(self, user_id, data):
+        self.missing.discard(user_id)
+        dict.__setitem__(self, user_id, data)
+
+    def get(self, user_id, default=None):
+        self._load(user_id)
+        return dict.get(self, user_id, default)
+
+
+class BackgroundStore:
+    """SQLite database whose connection lives on one background thread.
+
+    Every query runs on that thread, so reads and writes never block the
+    event loop and never run concurrently on the connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=os.path.basename(path))
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _create_tables(self):
+        raise NotImplementedError
+
+    def _open(self):
+        # Shard workers share the file, so wait for each other's write locks
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+        self.conn.commit()
+
+    async def open(self):
+        await self.run(self._open)
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        self.executor.submit(self._close)
+        self.executor.shutdown(wait=True)
+
+
+class HealthStore(BackgroundStore):
+    """Time series of health, debt and oracle price per position.
+
+    Points come from our own polled stats and from the Curve snapshots endpoint.
+    """
+
+    def __init__(self, path=HEALTH_DB_FILE):
+        super().__init__(path)
+
+    def _create_tables(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS health ('
+                          'chain TEXT NOT NULL, '
+                          'wallet TEXT NOT NULL, '
+                          'controller TEXT NOT NULL, '
+                          'timestamp INTEGER NOT NULL, '
+                          'health REAL NOT NULL, '
+                          'debt REAL, '
+                          'oracle_price REAL, '
+                          'PRIMARY KEY (chain, wallet, controller, timestamp)) WITHOUT ROWID')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS health_timestamp ON health (timestamp)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS snapshot_sync ('
+                          'chain TEXT NOT NULL, '
+                          'wallet TEXT NOT NULL, '
+                          'controller TEXT NOT NULL, '
+                          'synced_until INTEGER NOT NULL, '
+                          'PRIMARY KEY (chain, wallet, controller))')
+
+    def _add_points(self, rows):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO health (chain, wallet, controller, timestamp, health, debt, oracle_price) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+            )
+
+    async def add_points(self, rows):
+        """Store (chain, wallet, controller, timestamp, health, debt, oracle_price) rows."""
+        if rows:
+            await self.run(self._add_points, rows)
+
+    def _add_snapshots(self, key, points, synced_until):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO health (chain, wallet, controller, timestamp, health, debt, oracle_price) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', [key + tuple(point) for point in points]
+            )
+            self.conn.execute('INSERT OR REPLACE INTO snapshot_sync (chain, wallet, controller, synced_until) '
+                              'VALUES (?, ?, ?, ?)', key + (synced_until,))
+
+    async def add_snapshots(self, key, points, synced_until):
+        """Store (timestamp, health, debt, oracle_price) snapshot points and remember how far we synced."""
+        await self.run(self._add_snapshots, key, points, synced_until)
+
+    def _synced_until(self, key):
+        row = self.conn.execute('SELECT synced_until FROM snapshot_sync WHERE chain = ? AND wallet = ? AND controller = ?',
+                                key).fetchone()
+        return row[0] if row else None
+
+    async def synced_until(self, key):
+        """Timestamp of the newest snapshot we hold for a position, or None if it was never synced."""
+        return await self.run(self._synced_until, key)
+
+    def _points_before(self, key, timestamps):
+        points = []
+        for timestamp in timestamps:
+            row = self.conn.execute('SELECT timestamp, health FROM health '
+                                    'WHERE chain = ? AND wallet = ? AND controller = ? AND timestamp <= ? '
+                                    'ORDER BY timestamp DESC LIMIT 1', key + (timestamp,)).fetchone()
+            points.append(row)
+        return points
+
+    async def points_before(self, key, timestamps):
+        """For each timestamp, the newest (timestamp, health) point at or before it, or None."""
+        return await self.run(self._points_before, key, timestamps)
+
+    def _latest(self, keys):
+        latest = {}
+        for key in keys:
+            row = self.conn.execute('SELECT timestamp, health FROM health '
+                                    'WHERE chain = ? AND wallet = ? AND controller = ? '
+                                    'ORDER BY timestamp DESC LIMIT 1', key).fetchone()
+            if row is not None:
+                latest[key] = row
+        return latest
+
+    async def latest(self, keys):
+        """The newest (timestamp, health) point of each position that has one."""
+        return await self.run(self._latest, list(keys))
+
+    def _prune(self, before):
+        with self.conn:
+            return self.conn.execute('DELETE FROM health WHERE timestamp < ?', (before,)).rowcount
+
+    async def prune(self, before):
+        return await self.run(self._prune, before)
+
+
+class MonitorStateStore(BackgroundStore):
+    """Monitor state that survives restarts: sent notifications and the last stats of each position."""
+
+    def __init__(self, path=MONITOR_STATE_DB_FILE):
+        super().__init__(path)
+
+    def _create_tables(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS notifications ('
+                          'user_id TEXT NOT NULL, '
+                          'position_key TEXT NOT NULL, '
+                          'sent_at REAL NOT NULL, '
+                          'PRIMARY KEY (user_id, position_key))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS positions ('
+                          'chain TEXT NOT NULL, '
+                          'wallet TEXT NOT NULL, '
+                          'controller TEXT NOT NULL, '
+                          'market_name TEXT, '
+                          'stats TEXT, '
+                          'updated_at REAL NOT NULL, '
+                          'PRIMARY KEY (chain, wallet, controller))')
+
+    def _save(self, notifications, positions):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO notifications (user_id, position_key, sent_at) '
+                                  'VALUES (?, ?, ?)', notifications)
+            self.conn.executemany('INSERT OR REPLACE INTO positions (chain, wallet, controller, market_name, stats, updated_at) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)',
+                                  [key + (market_name, json.dumps(stats._asdict() if stats else None), updated_at)
+                                   for key, market_name, stats, updated_at in positions])
+
+    async def save(self, notifications=(), positions=()):
+        """Store (user_id, position_key, sent_at) notifications and (key, market_name, stats, updated_at) positions."""
+        await self.run(self._save, list(notifications), list(positions))
+
+    def _prune(self, before):
+        with self.conn:
+            removed = self.conn.execute('DELETE FROM positions WHERE updated_at < ?', (before,)).rowcount
+            # Position keys are chain_wallet_controller, as the monitor builds them
+            self.conn.execute('DELETE FROM notifications WHERE position_key NOT IN '
+                              "(SELECT chain || '_' || wallet || '_' || controller FROM positions)")
+            return removed
+
+    async def prune(self, before):
+        """Forget positions last checked before before, and the notifications of positions no longer saved.
+
+        Notifications are kept however old while their position is still checked, so a
+        user who asked never to be alerted twice is not alerted again.
+        """
+        return await self.run(self._prune, before)
+
+    def _load(self):
+        notifications = self.conn.execute('SELECT user_id, position_key, sent_at FROM notifications').fetchall()
+        positions = [(intern_key(chain, wallet, controller), intern_text(market_name),
+                      PositionStats.from_json(json.loads(stats)) if stats else None, updated_at)
+                     for chain, wallet, controller, market_name, stats, updated_at
+                     in self.conn.execute('SELECT chain, wallet, controller, market_name, stats, updated_at FROM positions')]
+        return notifications, positions
+
+    async def load(self):
+        return await self.run(self._load)
+
+    def _load_notifications(self, user_ids):
+        notifications = []
+        for i in range(0, len(user_ids), SQLITE_MAX_PARAMS):
+            chunk = user_ids[i:i + SQLITE_MAX_PARAMS]
+            notifications += self.conn.execute('SELECT user_id, position_key, sent_at FROM notifications '
+                                               f"WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+        return notifications
+
+    async def load_notifications(self, user_ids):
+        """(user_id, position_key, sent_at) of the notifications sent to the given users."""
+        return await self.run(self._load_notifications, [str(user_id) for user_id in user_ids])
+
+
+class MarketIndexStore(BackgroundStore):
+    """Markets each wallet has a position in, per chain, and when the wallet was last looked up."""
+
+    def __init__(self, path=MARKET_INDEX_DB_FILE):
+        super().__init__(path)
+
+    def _create_tables(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS wallets ('
+                          'chain TEXT NOT NULL, '
+                          'wallet TEXT NOT NULL, '
+                          'looked_up_at REAL NOT NULL, '
+                          'PRIMARY KEY (chain, wallet))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS markets ('
+                          'chain TEXT NOT NULL, '
+                          'wallet TEXT NOT NULL, '
+                          'controller TEXT NOT NULL, '
+                          'market_name TEXT, '
+                          'position INTEGER NOT NULL, '
+                          'PRIMARY KEY (chain, wallet, controller))')
+
+    def _save_wallet(self, chain, wallet, markets, looked_up_at):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO wallets (chain, wallet, looked_up_at) VALUES (?, ?, ?)',
+                              (chain, wallet, looked_up_at))
+            self.conn.execute('DELETE FROM markets WHERE chain = ? AND wallet = ?', (chain, wallet))
+            self.conn.executemany('INSERT INTO markets (chain, wallet, controller, market_name, position) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  [(chain, wallet, controller, market_name, position)
+                                   for position, (controller, market_name) in enumerate(markets.items())])
+
+    async def save_wallet(self, chain, wallet, markets, looked_up_at):
+        """Replace the markets ({controller: market_name}) of a wallet on a chain."""
+        await self.run(self._save_wallet, chain, wallet, dict(markets), looked_up_at)
+
+    def _remove_market(self, chain, wallet, controller):
+        with self.conn:
+            self.conn.execute('DELETE FROM markets WHERE chain = ? AND wallet = ? AND controller = ?',
+                              (chain, wallet, controller))
+
+    async def remove_market(self, chain, wallet, controller):
+        await self.run(self._remove_market, chain, wallet, controller)
+
+    def _load(self):
+        index = {intern_key(chain, wallet): (looked_up_at, {}) for chain, wallet, looked_up_at
+                 in self.conn.execute('SELECT chain, wallet, looked_up_at FROM wallets')}
+        for chain, wallet, controller, market_name in self.conn.execute(
+                'SELECT chain, wallet, controller, market_name FROM markets ORDER BY chain, wallet, position'):
+            if (chain, wallet) in index:
+                index[(chain, wallet)][1][intern_text(controller)] = intern_text(market_name)
+        return index
+
+    async def load(self):
+        """{(chain, wallet): (looked_up_at, {controller: market_name})}"""
+        return await self.run(self._load)
@@ -0,0 +1,84 @@
+"""Price-shock scenarios for lending positions, evaluated for all positions at once with NumPy.
+
+Each position is reduced to a few numbers from its stats: oracle price p0,
+collateral c, debt D, full health h0 and the number of bands N = n2 - n1 + 1.
+Health is treated as linear in the collateral price:
+
+    h(p) = h0 + k * (p - p0),  k = c * (1 - LIQUIDATION_DISCOUNT) / D
+
+so the liquidation price (h = 0) is p0 - h0 / k. The position enters soft
+liquidation when the price reaches the top of its bands, N bands of width
+1/A above the bottom one: liquidation price * (A / (A - 1)) ** N. A position
+already in soft liquidation is in it at any price at or below p0.
+
+This is an estimate from the /stats fields, not the exact LLAMMA curve: losses
+while bands are being converted are ignored and the market's own A and
+discount are replaced by typical values.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Typical market parameters
+AMPLIFICATION = 100  # A of the AMM, each band is 1/A wide
+LIQUIDATION_DISCOUNT = 0.06  # Share of collateral value not counted towards health
+
+# Per-position inputs, one array element per position
+PositionArrays = namedtuple('PositionArrays', ['oracle_price', 'debt', 'collateral', 'health', 'bands',
+                                               'soft_liquidation'])
+
+# health, soft_liquidation and liquidated are (positions, shocks) arrays, health in percent;
+# the prices are per position
+StressResult = namedtuple('StressResult', ['health', 'soft_liquidation', 'liquidated', 'soft_liquidation_price',
+                                           'liquidation_price'])
+
+
+def load_positions(stats_list):
+    """PositionArrays from a list of /stats dicts."""
+    count = len(stats_list)
+
+    def column(name, default=0.0):
+        return np.fromiter(((stats.get(name) or default) for stats in stats_list), dtype=np.float64, count=count)
+
+    bands = np.fromiter(((stats.get('n2') or 0) - (stats.get('n1') or 0) + 1 for stats in stats_list),
+                        dtype=np.float64, count=count)
+    return PositionArrays(
+        oracle_price=column('oracle_price'),
+        debt=column('debt'),
+        collateral=column('collateral'),
+        health=column('health_full') / 100,
+        bands=np.maximum(bands, 1),
+        soft_liquidation=np.fromiter((bool(stats.get('soft_liquidation')) for stats in stats_list),
+                                     dtype=bool, count=count),
+    )
+
+
+def stress_test(positions, shocks, amplification=AMPLIFICATION, liquidation_discount=LIQUIDATION_DISCOUNT):
+    """Evaluate every position under every relative collateral price shock (e.g. -0.1 for a 10% drop)."""
+    shocks = np.asarray(shocks, dtype=np.float64)
+    price = positions.oracle_price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(positions.debt > 0, positions.collateral * (1 - liquidation_discount) / positions.debt, 0.0)
+        liquidation_price = np.where(slope > 0, np.maximum(price - positions.health / slope, 0.0), np.nan)
+    band_range = (amplification / (amplification - 1)) ** positions.bands
+    soft_liquidation_price = liquidation_price * band_range
+    soft_liquidation_price = np.where(positions.soft_liquidation, np.fmax(soft_liquidation_price, price),
+                                      soft_liquidation_price)
+
+    shocked_price = price[:, None] * (1 + shocks[None, :])
+    health = positions.health[:, None] + (slope * price)[:, None] * shocks[None, :]
+    liquidated = health <= 0
+    soft_liquidation = (shocked_price <= soft_liquidation_price[:, None]) & ~liquidated
+    return StressResult(
+        health=health * 100,
+        soft_liquidation=soft_liquidation,
+        liquidated=liquidated,
+        soft_liquidation_price=soft_liquidation_price,
+        liquidation_price=liquidation_price,
+    )
+
+
+def summarize(positions, result):
+    """Per shock: positions in soft liquidation, positions liquidatable and their total debt."""
+    return (result.soft_liquidation.sum(axis=0), result.liquidated.sum(axis=0),
+            positions.debt @ result.liquidated)